@@ -1,33 +1,300 @@
-from flask import Flask, jsonify, request, g
+from flask import Flask, Response, jsonify, request, g, stream_with_context
+from collections import OrderedDict
+from functools import wraps
+import base64
+import hashlib
+import json
 import logging
+import math
 import sys
 import os
+import threading
+import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'DatabaseScripts')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'WebScrappingScripts')))
 
-from database import create_connection, close_connection#type:ignore
+from database import ConnectionPool, DEFAULT_DB_PATH, create_connection, create_table, close_connection, get_data_generation, schema_is_current, get_latest_scrape_run, list_changes, list_products, search_products, build_search_query, PRODUCT_SORTS#type:ignore
+from matching import compare_products, get_group_offers#type:ignore
+from stats import CHEAPEST_PER_SOURCE, get_stats#type:ignore
+from export import EXPORT_COLUMNS, EXPORT_FORMATS, export_products#type:ignore
+from metrics import MetricsRegistry, format_labels, render_prometheus#type:ignore
 
 
-# Dynamically get the absolute path to the database file
-db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'DatabaseScripts', 'products.db')
+# The database ConnectorScript writes to
+db_path = DEFAULT_DB_PATH
 
 app = Flask(__name__)
 
+# Page sizes for the paginated /products listing
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Query parameters that switch /products from the full dump to a paginated listing
+LISTING_PARAMETERS = ('source', 'min_price', 'max_price', 'limit', 'sort', 'cursor')
+
+# Fields of each product in the full /products dump, as older clients expect them
+LEGACY_PRODUCT_COLUMNS = ['id', 'image', 'name', 'price', 'source']
+
+# Response cache limits: most entries kept, total bytes kept, and the largest single body worth keeping
+CACHE_MAX_ENTRIES = 256
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_MAX_ENTRY_BYTES = 16 * 1024 * 1024
+
+# SQLite's signed 64-bit INTEGER range, which every whole number bound to a query has to fit
+SQLITE_MIN_INTEGER = -2 ** 63
+SQLITE_MAX_INTEGER = 2 ** 63 - 1
+
 # Logging setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Read-only connections reused across requests; the API never writes to the products
+_pool = None
+
+def get_pool():
+    """Returns the read connection pool for db_path, replacing it if db_path has changed."""
+    global _pool
+    if _pool is None or _pool.db_file != db_path:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(db_path)
+    return _pool
+
+class BadRequest(Exception):
+    """Raised for invalid query parameters; turned into a 400 response."""
+
+class DatabaseUnavailable(Exception):
+    """Raised when no connection to the database can be opened; turned into a 503 response."""
+
+@app.errorhandler(BadRequest)
+def handle_bad_request(error):
+    return jsonify({'error': str(error)}), 400
+
+@app.errorhandler(DatabaseUnavailable)
+def handle_database_unavailable(error):
+    return jsonify({'error': str(error)}), 503
+
 def get_db():
-    """Opens a new database connection if there is none yet for the current application context."""
+    """Borrows a pooled read-only connection for the current application context."""
     if 'db' not in g:
-         g.db = create_connection(db_path)
+        conn = get_pool().acquire()
+        if conn is None:
+            raise DatabaseUnavailable("The products database can't be opened; run flask --app app init-db to create it")
+        # The API doesn't migrate the database itself, and the queries need the current schema
+        if not schema_is_current(conn):
+            get_pool().release(conn)
+            raise DatabaseUnavailable("The products database hasn't been migrated; run flask --app app init-db")
+        g.db = conn
     return g.db
 
+def prepare_database():
+    """
+    Makes sure the database exists with the current schema, indexes and WAL mode. Run it once
+    before serving requests (flask --app app init-db), not on import: the migrations write to
+    the database.
+    """
+    conn = create_connection(db_path)
+    if conn is not None:
+        create_table(conn)
+        close_connection(conn)
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Creates or migrates the products database."""
+    prepare_database()
+
+def encode_cursor(product, sort):
+    """Makes an opaque cursor pointing just after the given product in the given sort order."""
+    column = PRODUCT_SORTS[sort][0]
+    value = json.dumps([sort, product[column], product['id']])
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, sort):
+    """Turns a cursor back into the (sort value, id) the next page starts after."""
+    try:
+        cursor_sort, value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise BadRequest("Invalid cursor")
+    if cursor_sort != sort:
+        raise BadRequest("The cursor belongs to a different sort order")
+    # The cursor comes from the client, so only values SQLite can bind get through to the query
+    if not (value is None or isinstance(value, (str, float)) or is_sqlite_integer(value)) or not is_sqlite_integer(product_id):
+        raise BadRequest("Invalid cursor")
+    return value, product_id
+
+def is_sqlite_integer(value):
+    """Whether value is a whole number (not a bool) that fits in an SQLite INTEGER."""
+    return isinstance(value, int) and not isinstance(value, bool) and SQLITE_MIN_INTEGER <= value <= SQLITE_MAX_INTEGER
+
+def price_argument(name):
+    """Reads an optional price in rands from the query string and converts it to cents."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        price = float(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be a number")
+    # float() also accepts inf and nan, which can't be turned into cents
+    if not math.isfinite(price):
+        raise BadRequest(f"{name} must be a number")
+    cents = round(price * 100)
+    if not SQLITE_MIN_INTEGER <= cents <= SQLITE_MAX_INTEGER:
+        raise BadRequest(f"{name} is out of range")
+    return cents
+
+def limit_argument():
+    """Reads the page size from the query string."""
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest("limit must be a whole number")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise BadRequest(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+class ResponseCache:
+    """
+    LRU cache of response bodies keyed by request path, query string and data generation.
+
+    The generation is bumped in the database by every scraper write that changes products, so
+    an entry from an older generation can never be served: it just ages out of the LRU.
+    Entries are limited by count and by total size. Safe to share between threads.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, max_entry_bytes=CACHE_MAX_ENTRY_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the cached (body, mimetype) for key, or None, counting the hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype):
+        """Stores a body, evicting the least recently used entries to stay within the limits."""
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+            self._entries[key] = (body, mimetype)
+            self._size += len(body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else None,
+            }
+
+response_cache = ResponseCache()
+
+def tee_into_cache(response, key):
+    """Wraps a streamed response so its body is cached once it has been sent in full."""
+    chunks = response.response
+    mimetype = response.mimetype
+
+    def generate():
+        parts = []
+        size = 0
+        for chunk in chunks:
+            yield chunk
+            if parts is not None:
+                part = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                size += len(part)
+                # Stop collecting once the body is too big to be worth keeping
+                if size <= response_cache.max_entry_bytes:
+                    parts.append(part)
+                else:
+                    parts = None
+        if parts is not None:
+            response_cache.put(key, b''.join(parts), mimetype)
+
+    response.response = generate()
+
+def cached(view):
+    """
+    Serves a GET endpoint from the response cache, with an ETag so clients can revalidate.
+
+    The ETag is derived from the data generation and the request, so between scrape runs a
+    client sending If-None-Match gets 304 Not Modified without the view running at all.
+    Only successful responses are cached.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        generation = get_data_generation(get_db())
+        query = sorted(request.args.items(multi=True))
+        request_key = hashlib.sha1(json.dumps([request.path, query]).encode('utf-8')).hexdigest()[:16]
+        etag = f"{generation}-{request_key}"
+        key = (generation, request_key)
+
+        if request.if_none_match.contains(etag):
+            response_cache.record_not_modified()
+            response = Response(status=304)
+        else:
+            entry = response_cache.get(key)
+            if entry is not None:
+                response = Response(entry[0], mimetype=entry[1])
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if response.is_streamed:
+                    tee_into_cache(response, key)
+                else:
+                    response_cache.put(key, response.get_data(), response.mimetype)
+
+        response.set_etag(etag)
+        # Clients may keep the body but must check the ETag before reusing it
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
+# Request latencies by endpoint, served by /metrics alongside the last scrape run's metrics
+api_metrics = MetricsRegistry()
+
 @app.before_request
 def log_request_info():
     logging.info(f"Request: {request.method} {request.url}")
+    g.request_started = time.perf_counter()
 
 @app.after_request
 def log_response_info(response):
     logging.info(f"Response: {response.status_code}")
+    # Streamed bodies are still being sent at this point, so this is the time to the first byte
+    if 'request_started' in g:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        api_metrics.observe('request_seconds', time.perf_counter() - g.request_started,
+                            endpoint=endpoint, method=request.method, status=response.status_code)
     return response
 
 @app.route('/')
@@ -36,33 +303,231 @@ def home():
 
 #  API endpoint to retrieve products
 @app.route('/products', methods=['GET'])
+@cached
 def get_products():
+    """
+    Without query parameters this returns every product, as older clients expect.
+
+    With any of source, min_price, max_price (in rands), limit, sort (id, price, -price or name)
+    or cursor it returns one page: {"products": [...], "next_cursor": ...}, where next_cursor
+    is passed back to get the following page and is null on the last one.
+    """
+    if any(name in request.args for name in LISTING_PARAMETERS):
+        return get_products_page()
+
+    # Stream the JSON array a chunk of rows at a time instead of building the whole list first
+    return Response(stream_export('json', LEGACY_PRODUCT_COLUMNS), mimetype='application/json')
+
+#  API endpoint for bulk consumers that need the whole table
+@app.route('/products/export', methods=['GET'])
+def export_all_products():
+    """
+    Streams every product as a chunked response in the requested format:
+    json (one array), ndjson (one object per line) or csv. Server memory stays bounded
+    because rows are read and written a chunk at a time.
+
+    Not cached: it includes last_seen, which every scrape updates without a new data generation.
+    """
+    fmt = request.args.get('format', 'json')
+    if fmt not in EXPORT_FORMATS:
+        raise BadRequest(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+
+    # Borrowed up front, so a missing database is a 503 rather than a broken stream
+    get_db()
+    response = Response(stream_export(fmt), mimetype=EXPORT_FORMATS[fmt][1])
+    if fmt == 'csv':
+        response.headers['Content-Disposition'] = 'attachment; filename=products.csv'
+    return response
+
+@stream_with_context
+def stream_export(fmt, columns=EXPORT_COLUMNS):
+    """
+    Yields an export while the response is being sent. The connection is opened inside the
+    generator so it belongs to the streaming context and is only closed once the body is done.
+    """
+    yield from export_products(get_db(), fmt, columns=columns)
+
+def parse_since(since):
+    """
+    Reads the change feed position: a version number (everything after it) or the
+    "version:id" cursor returned for a page that was cut short.
+    """
+    try:
+        if ':' in since:
+            version, product_id = (int(part) for part in since.split(':', 1))
+        else:
+            # Product ids start at 1, so (version + 1, 0) comes right after the whole of version
+            version, product_id = int(since) + 1, 0
+    except ValueError:
+        raise BadRequest("since must be a version number or a cursor from next_since")
+    if not (is_sqlite_integer(version) and is_sqlite_integer(product_id)):
+        raise BadRequest("since is out of range")
+    return version, product_id
+
+#  API endpoint for clients that mirror the catalogue
+@app.route('/products/changes', methods=['GET'])
+@cached
+def get_product_changes():
+    """
+    Returns the products inserted, updated or deleted since the given position, oldest first:
+    {"changes": [{"op": "upsert"|"delete", "version", "product"}, ...], "next_since", "more"}.
+
+    Pass next_since back as since on the next poll. When more is true the client should poll
+    again straight away; since=0 gives the whole catalogue.
+    """
+    after = parse_since(request.args.get('since', '0'))
+    limit = limit_argument()
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM products')
-    rows = cursor.fetchall()
-    
-    products = []
-    # Iterate through each row returned from the database
-    for row in rows:
-        # Map the row data to a product dictionary
-        product = {
-            'id': row[0],
-            'image': row[1],
-            'name': row[2],
-            'price': row[3],
-            'source': row[4]
-        }
-        products.append(product)
-     # Return the list of products as a JSON response
-    return jsonify(products)
+
+    # Read the generation first: anything committed after this has a higher version, so a
+    # drained feed can safely continue from it
+    generation = get_data_generation(conn)
+    changes = list_changes(conn, after=after, limit=limit + 1)
+    if len(changes) > limit:
+        changes = changes[:limit]
+        last = changes[-1]
+        next_since = f"{last['version']}:{last['product']['id']}"
+    else:
+        next_since = str(max([generation, after[0] - 1] + [change['version'] for change in changes]))
+    return jsonify({'changes': changes, 'next_since': next_since, 'more': ':' in next_since})
+
+def get_products_page():
+    """Builds one page of the filtered /products listing from a single indexed query."""
+    sort = request.args.get('sort', 'id')
+    if sort not in PRODUCT_SORTS:
+        raise BadRequest(f"sort must be one of: {', '.join(PRODUCT_SORTS)}")
+
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor, sort) if cursor else None
+    limit = limit_argument()
+
+    # Fetch one extra row to find out whether there is a next page
+    products = list_products(
+        get_db(),
+        source=request.args.get('source'),
+        min_price_cents=price_argument('min_price'),
+        max_price_cents=price_argument('max_price'),
+        sort=sort,
+        after=after,
+        limit=limit + 1
+    )
+    next_cursor = encode_cursor(products[limit - 1], sort) if len(products) > limit else None
+    return jsonify({'products': products[:limit], 'next_cursor': next_cursor})
+
+#  API endpoint for full-text search on product names
+@app.route('/search', methods=['GET'])
+@cached
+def search():
+    """
+    Searches product names for every word in q, the last word as a prefix, best matches first.
+
+    Takes optional source, limit and offset; returns {"products": [...], "next_offset": ...},
+    where next_offset is null on the last page.
+    """
+    text = request.args.get('q', '')
+    if build_search_query(text) is None:
+        raise BadRequest("q must contain at least one word")
+    limit = limit_argument()
+    try:
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        raise BadRequest("offset must be a whole number")
+    if offset < 0:
+        raise BadRequest("offset can't be negative")
+    if not is_sqlite_integer(offset + limit + 1):
+        raise BadRequest("offset is out of range")
+
+    # Fetch one extra row to find out whether there is a next page
+    products = search_products(get_db(), text, source=request.args.get('source'), limit=limit + 1, offset=offset)
+    next_offset = offset + limit if len(products) > limit else None
+    return jsonify({'products': products[:limit], 'next_offset': next_offset})
+
+#  API endpoints comparing the same item across retailers
+@app.route('/compare', methods=['GET'])
+@cached
+def compare():
+    """
+    Finds the items whose names best fit q and returns each one's offers across retailers,
+    cheapest first: {"groups": [{"id", "name", "cheapest", "offers"}, ...]}. Takes an optional limit.
+    """
+    text = request.args.get('q', '')
+    if build_search_query(text) is None:
+        raise BadRequest("q must contain at least one word")
+    return jsonify({'groups': compare_products(get_db(), text, limit=limit_argument())})
+
+@app.route('/compare/<int:group_id>', methods=['GET'])
+@cached
+def compare_group(group_id):
+    """Returns one item's offers across retailers, cheapest first."""
+    # An id too big for SQLite can't be a group
+    group = get_group_offers(get_db(), [group_id]).get(group_id) if is_sqlite_integer(group_id) else None
+    if group is None:
+        return jsonify({'error': 'No such group'}), 404
+    return jsonify(group)
+
+#  API endpoint for dashboards
+@app.route('/stats', methods=['GET'])
+@cached
+def stats():
+    """
+    Returns product count and min, max and average price per source, the cheapest products and
+    the biggest latest price drops, read straight from the summary tables ConnectorScript
+    refreshes after each run. Takes optional source and limit (up to CHEAPEST_PER_SOURCE).
+    """
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        raise BadRequest("limit must be a whole number")
+    if not 1 <= limit <= CHEAPEST_PER_SOURCE:
+        raise BadRequest(f"limit must be between 1 and {CHEAPEST_PER_SOURCE}")
+    return jsonify(get_stats(get_db(), limit=limit, source=request.args.get('source')))
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Reports response cache hits, misses, 304s and size, for checking the cache under load."""
+    return jsonify(response_cache.stats())
+
+def scrape_run_metrics(run):
+    """Prometheus lines for the latest scrape run: its summary as gauges, then its histograms and counters."""
+    lines = []
+    for name, value in [('duration_seconds', run['duration_seconds']), ('pages', run['pages']),
+                        ('failed_pages', run['failed_pages']), ('skipped_pages', run['skipped_pages']),
+                        ('products', run['products'])]:
+        lines.append(f'# TYPE scraper_last_run_{name} gauge')
+        lines.append(f'scraper_last_run_{name}{format_labels({"mode": run["mode"]})} {value}')
+    lines.append('# TYPE scraper_last_run_products_written gauge')
+    for result in ('inserted', 'updated', 'unchanged', 'skipped'):
+        lines.append(f'scraper_last_run_products_written{format_labels({"result": result})} {run[result]}')
+    return '\n'.join(lines) + '\n' + render_prometheus(run['metrics'], prefix='scraper_')
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Serves metrics in the Prometheus text format: the last scrape run's summary, per-page and
+    per-stage timings and counts from scrape_runs, plus this API's request latencies and cache counters.
+    """
+    conn = get_db()
+    parts = []
+    run = get_latest_scrape_run(conn)
+    if run is not None:
+        parts.append(scrape_run_metrics(run))
+
+    parts.append(render_prometheus(api_metrics.snapshot(), prefix='api_'))
+    cache = response_cache.stats()
+    for name in ('hits', 'misses', 'not_modified', 'evictions'):
+        parts.append(f'# TYPE api_cache_{name}_total counter\napi_cache_{name}_total {cache[name]}\n')
+    for name in ('entries', 'bytes'):
+        parts.append(f'# TYPE api_cache_{name} gauge\napi_cache_{name} {cache[name]}\n')
+    parts.append(f'# TYPE data_generation gauge\ndata_generation {get_data_generation(conn)}\n')
+    return Response(''.join(parts), mimetype='text/plain; version=0.0.4')
 
 @app.teardown_appcontext
- # Remove the database connection from the context
+ # Return the database connection to the pool
 def close_db_connection(exception):
     db = g.pop('db', None)
     if db is not None:
-        close_connection(db)
+        get_pool().release(db)
 
 if __name__ == "__main__":
+    prepare_database()
     app.run(debug=True)
@@ -0,0 +1,431 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+# Everything runs against a throwaway database, so point the shared connection layer at it
+# before database.py and the API, which read PRODUCTS_DB on import, are loaded
+BENCHMARK_DIR = tempfile.mkdtemp(prefix='price-benchmark-')
+os.environ['PRODUCTS_DB'] = os.path.join(BENCHMARK_DIR, 'api.db')
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(ROOT, 'DatabaseScripts'))
+sys.path.append(os.path.join(ROOT, 'WebScrappingScripts'))
+sys.path.append(os.path.join(ROOT, 'API'))
+from database import create_connection, create_table, close_connection, upsert_products#type:ignore
+from http_fetch import HttpBackend#type:ignore
+from page_archive import PageArchive#type:ignore
+from rate_limiter import set_rate_limiter#type:ignore
+import checkers#type:ignore
+import picknpay#type:ignore
+import woolworths#type:ignore
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Logging setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Retailer definitions benchmarked, keyed by the name they archive pages under
+SCRAPERS = {
+    "checkers": checkers.RETAILER,
+    "picknpay": picknpay.RETAILER,
+    "woolworths": woolworths.RETAILER,
+}
+
+# Where result files go unless --output is given
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Catalogue sizes for the upsert benchmark
+UPSERT_SIZES = [1000, 10000, 100000]
+
+# API endpoints load-tested, with the query each one is called with
+API_ENDPOINTS = [
+    ('products_dump', '/products'),
+    ('products_page', '/products?limit=50&sort=price'),
+    ('products_source', '/products?source=Checkers&limit=50'),
+    ('search', '/search?q=bread'),
+    ('stats', '/stats'),
+]
+
+WORDS = ("bread milk ciabatta cheese yoghurt apple banana chicken rice pasta sauce tomato butter juice "
+         "coffee tea sugar flour eggs oil brown white full cream low fat fresh frozen organic").split()
+UNITS = ["g", "kg", "ml", "L", "pk"]
+
+# ---------------------------------------------------------------------------
+# Fixture pages
+# ---------------------------------------------------------------------------
+
+def product_name(rng, index):
+    return f"{' '.join(rng.sample(WORDS, 3)).title()} {index} {rng.choice([1, 2, 250, 400, 500, 750])} {rng.choice(UNITS)}"
+
+def page_padding(kilobytes):
+    """Navigation-like markup, so fixture pages are about as heavy to parse as the real ones."""
+    item = '<li class="nav__item"><a class="nav__link" href="/c/{0}">Category {0}</a></li>'
+    count = max(0, kilobytes * 1024 // 70)
+    return '<nav><ul class="nav">' + ''.join(item.format(i) for i in range(count)) + '</ul></nav>'
+
+def checkers_card(rng, index):
+    return (f'<div class="item-product"><div class="item-product__image __image"><a href="/p/{index}">'
+            f'<img src="/medias/{index}.png"></a></div>'
+            f'<h3 class="item-product__name"><a href="/p/{index}">{product_name(rng, index)}</a></h3>'
+            f'<div class="special-price__price"><span>R{rng.randint(5, 400)}.{rng.randint(0, 99):02d}</span></div></div>')
+
+def picknpay_card(rng, index):
+    price = f'R{rng.randint(5, 400)}.{rng.randint(0, 99):02d}'
+    # Every fifth card carries a promo price
+    price_markup = (f'<div class="price price_promo"><span>{price}</span></div>' if index % 5 == 0
+                    else f'<div class="price">{price}</div>')
+    return (f'<ui-product-grid-item class="ng-star-inserted"><img src="/images/{index}.png">'
+            f'<div class="product-grid-item__info-container"><a href="/p/{index}"><span>{product_name(rng, index)}</span></a></div>'
+            f'<div class="cms-price-display"><div>{price_markup}</div></div></ui-product-grid-item>')
+
+def woolworths_card(rng, index):
+    # Every fourth card uses the older description markup for its name
+    name = product_name(rng, index)
+    name_markup = (f'<div class="product--desc"><a href="/p/{index}"><h2>{name}</h2></a></div>' if index % 4 == 0
+                   else f'<div class="range--title product-card__name"><a href="/p/{index}">{name}</a></div>')
+    return (f'<div class="product-list__item"><div class="product--image"><img src="/images/{index}.jpg"></div>'
+            f'{name_markup}<span class="font-graphic"><strong>R {rng.randint(5, 400)}.{rng.randint(0, 99):02d}</strong></span></div>')
+
+def build_fixture_page(retailer, page_number, cards=24, padding_kb=200):
+    """Builds a synthetic listing page with the markup the retailer's selectors expect."""
+    rng = random.Random(f"{retailer}-{page_number}")
+    first = page_number * cards
+    if retailer == "checkers":
+        grid = ('<div class="product__listing product__grid">'
+                + ''.join(checkers_card(rng, first + i) for i in range(cards)) + '</div>')
+    elif retailer == "picknpay":
+        grid = ('<div class="cx-product-container--grid ml-0 mr-0 ng-star-inserted">'
+                + ''.join(picknpay_card(rng, first + i) for i in range(cards)) + '</div>')
+    else:
+        grid = ('<div class="banner-wrapper"></div><div class="product-list">'
+                + ''.join(woolworths_card(rng, first + i) for i in range(cards)) + '</div>')
+    return f'<!DOCTYPE html><html><head><title>Page {page_number}</title></head><body>{page_padding(padding_kb)}{grid}</body></html>'
+
+def load_fixture_pages(retailer, page_count, archive=None):
+    """
+    Returns {page_number: html} for a retailer: its archived pages when an archive is given
+    and has any, otherwise page_count synthetic pages.
+    """
+    if archive is not None:
+        pages = dict(archive.iter_pages(retailer))
+        if pages:
+            return pages
+        logging.warning(f"No archived pages for {retailer}, using synthetic fixtures.")
+    return {page_number: build_fixture_page(retailer, page_number) for page_number in range(page_count)}
+
+class FixtureServer:
+    """
+    Serves fixture pages over HTTP on localhost, looked up by the live URL they stand in for:
+    GET /page?url=<live page URL>.
+    """
+
+    def __init__(self):
+        self.pages = {}
+        pages = self.pages
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = parse_qs(urlparse(self.path).query).get('url', [''])[0]
+                body = pages.get(url)
+                if body is None:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def add(self, url, html):
+        self.pages[url] = html
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FixtureBackend(HttpBackend):
+    """An HttpBackend that downloads each live URL's fixture from the local server instead."""
+
+    def __init__(self, server, pool_size=8):
+        super().__init__(pool_size=pool_size, retries=0)
+        self.server = server
+
+    def fetch(self, url):
+        return super().fetch(f'{self.server.base_url}/page?url={quote(url, safe="")}')
+
+# ---------------------------------------------------------------------------
+# Measurements
+# ---------------------------------------------------------------------------
+
+def current_rss_mb():
+    """Resident memory of this process in MB, or None where it can't be read."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where it can't be read."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10  # bytes on macOS, KB elsewhere
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def latency_summary(latencies, elapsed):
+    """Summarises request latencies (in seconds) as milliseconds, plus throughput."""
+    return {
+        'requests': len(latencies),
+        'requests_per_sec': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': max(latencies) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000,
+    }
+
+def benchmark_scrapers(page_count, workers, archive=None):
+    """
+    Measures each scraper's page parsing and its page loop over HTTP against local fixtures.
+
+    'parse' runs parse_product_info, the single-parse extraction extract_product_info uses, over
+    every page in memory. 'crawl' runs iter_pages (the loop main() and the connector use) with
+    use_http against the fixture server, with the rate limiter lifted.
+    """
+    results = {}
+    with FixtureServer() as server:
+        for name, scraper in SCRAPERS.items():
+            pages = load_fixture_pages(name, page_count, archive)
+            for page_number, html in pages.items():
+                server.add(scraper.page_url(page_number), html)
+
+            started = time.perf_counter()
+            parsed = sum(len(scraper.parse_product_info(html) or []) for html in pages.values())
+            parse_elapsed = time.perf_counter() - started
+
+            set_rate_limiter(scraper.page_url(0), {"rate": 1e9, "burst": 1e9, "max_rate": 1e9})
+            backend = FixtureBackend(server, pool_size=workers)
+            crawled = 0
+            started = time.perf_counter()
+            try:
+                for page_number, products in scraper.iter_pages(sorted(pages), workers=workers, use_http=True, http_backend=backend):
+                    crawled += len(products or [])
+            finally:
+                backend.close()
+            crawl_elapsed = time.perf_counter() - started
+
+            results[name] = {
+                'pages': len(pages),
+                'parse': {
+                    'seconds': parse_elapsed,
+                    'pages_per_sec': len(pages) / parse_elapsed,
+                    'products_per_sec': parsed / parse_elapsed,
+                    'products': parsed,
+                },
+                'crawl': {
+                    'workers': workers,
+                    'seconds': crawl_elapsed,
+                    'pages_per_sec': len(pages) / crawl_elapsed,
+                    'products_per_sec': crawled / crawl_elapsed,
+                    'products': crawled,
+                },
+            }
+            logging.info(f"{name}: {results[name]}")
+    return results
+
+def synthetic_products(count, seed=0, price_offset=0):
+    rng = random.Random(seed)
+    sources = ['Checkers', 'Pick n pay', 'Woolworths']
+    return [{
+        'image': f'https://example.invalid/{i}.png',
+        'name': product_name(rng, i),
+        'price': f'R{rng.randint(5, 400) + price_offset}.{rng.randint(0, 99):02d}',
+        'source': sources[i % 3],
+    } for i in range(count)]
+
+def timed_upsert(conn, products, batch_size):
+    """Upserts products in batches of batch_size, one transaction each, like the connector does per page."""
+    totals = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+    started = time.perf_counter()
+    for start in range(0, len(products), batch_size):
+        for key, value in upsert_products(conn, products[start:start + batch_size]).items():
+            totals[key] += value
+    elapsed = time.perf_counter() - started
+    return dict(totals, seconds=elapsed, products_per_sec=len(products) / elapsed)
+
+def benchmark_upserts(sizes, batch_size):
+    """
+    Measures upsert_products throughput into a fresh database at each size: the first scrape
+    (all inserts), a repeat scrape with nothing changed, and one where every price changed.
+    """
+    results = {}
+    for size in sizes:
+        path = os.path.join(BENCHMARK_DIR, f'upsert-{size}.db')
+        conn = create_connection(path)
+        create_table(conn)
+        products = synthetic_products(size)
+        results[str(size)] = {
+            'batch_size': batch_size,
+            'insert': timed_upsert(conn, products, batch_size),
+            'unchanged': timed_upsert(conn, products, batch_size),
+            'price_changes': timed_upsert(conn, synthetic_products(size, price_offset=1), batch_size),
+            'database_mb': os.path.getsize(path) / 2 ** 20,
+        }
+        close_connection(conn)
+        logging.info(f"upsert {size}: {results[str(size)]}")
+    return results
+
+def benchmark_api(catalogue_size, requests_per_endpoint, concurrency):
+    """
+    Load-tests the API over real HTTP: a threaded server in this process, hit by concurrency
+    client threads. Each endpoint is measured with the response cache disabled and enabled.
+    """
+    from werkzeug.serving import make_server
+    import app as api#type:ignore
+    from stats import refresh_summary_tables#type:ignore
+
+    api.prepare_database()
+    products = synthetic_products(catalogue_size)
+    conn = create_connection(api.db_path)
+    for start in range(0, catalogue_size, 500):
+        upsert_products(conn, products[start:start + 500])
+    refresh_summary_tables(conn)
+    close_connection(conn)
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, api.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    import requests
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def timed_get(path):
+        started = time.perf_counter()
+        response = session.get(base_url + path)
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    results = {'catalogue_size': catalogue_size, 'concurrency': concurrency, 'rss_mb_before': current_rss_mb(), 'endpoints': {}}
+    try:
+        for cached in (False, True):
+            api.response_cache = api.ResponseCache() if cached else api.ResponseCache(max_entries=0)
+            for name, path in API_ENDPOINTS:
+                timed_get(path)  # Warm up the connection pool (and the cache when it's on)
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    latencies = list(executor.map(timed_get, [path] * requests_per_endpoint))
+                summary = latency_summary(latencies, time.perf_counter() - started)
+                results['endpoints'][f"{name}{'_cached' if cached else ''}"] = dict(summary, path=path)
+                logging.info(f"{name} ({'cached' if cached else 'uncached'}): {summary}")
+        results['cache'] = api.response_cache.stats()
+    finally:
+        server.shutdown()
+        session.close()
+    results['rss_mb_after'] = current_rss_mb()
+    return results
+
+# ---------------------------------------------------------------------------
+# Running
+# ---------------------------------------------------------------------------
+
+def git_revision():
+    """The commit being benchmarked, with a -dirty suffix for uncommitted changes, or None."""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(suites, pages=20, workers=4, upsert_sizes=UPSERT_SIZES, batch_size=24, api_products=10000,
+         api_requests=200, concurrency=8, archive_dir=None, output=None):
+    """Runs the chosen benchmark suites and writes the results as JSON. Returns the output path."""
+    # Per-page progress logs would dominate the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    archive = PageArchive(archive_dir) if archive_dir else None
+
+    results = {
+        'revision': git_revision(),
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+    try:
+        if 'scrapers' in suites:
+            results['scrapers'] = benchmark_scrapers(pages, workers, archive)
+        if 'upserts' in suites:
+            results['upserts'] = benchmark_upserts(upsert_sizes, batch_size)
+        if 'api' in suites:
+            results['api'] = benchmark_api(api_products, api_requests, concurrency)
+    finally:
+        shutil.rmtree(BENCHMARK_DIR, ignore_errors=True)
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        output = os.path.join(RESULTS_DIR, f"benchmark-{stamp}-{results['revision'] or 'unknown'}.json")
+    with open(output, 'w', encoding='utf-8') as result_file:
+        json.dump(results, result_file, indent=2)
+    print(f"Results written to {output}")
+    return output
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers, database writes and API against local fixtures.")
+    parser.add_argument("suites", nargs="*", help="suites to run, from scrapers, upserts and api (default: all)")
+    parser.add_argument("--pages", type=int, default=20, help="synthetic fixture pages per retailer")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent page fetches in the crawl benchmark")
+    parser.add_argument("--archive", help="use pages from this page archive as fixtures instead of synthetic ones")
+    parser.add_argument("--upsert-sizes", type=int, nargs="+", default=UPSERT_SIZES, help="catalogue sizes for the upsert benchmark")
+    parser.add_argument("--batch-size", type=int, default=24, help="products per upsert transaction")
+    parser.add_argument("--api-products", type=int, default=10000, help="catalogue size for the API benchmark")
+    parser.add_argument("--api-requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent API clients")
+    parser.add_argument("--output", help="result file (default: BenchmarkScripts/results/benchmark-<time>-<commit>.json)")
+    args = parser.parse_args()
+
+    suites = set(args.suites or ['scrapers', 'upserts', 'api'])
+    unknown = suites - {'scrapers', 'upserts', 'api'}
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+    main(suites, pages=args.pages, workers=args.workers, upsert_sizes=args.upsert_sizes, batch_size=args.batch_size,
+         api_products=args.api_products, api_requests=args.api_requests, concurrency=args.concurrency,
+         archive_dir=args.archive, output=args.output)
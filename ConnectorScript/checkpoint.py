@@ -0,0 +1,76 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'DatabaseScripts')))
+from database import get_crawl_state, save_crawl_state#type:ignore
+import logging
+import uuid
+
+class CrawlCheckpoint:
+    """
+    Tracks a retailer's crawl progress in products.db so an interrupted run can be resumed.
+
+    A run that finishes with no failed pages is marked 'complete' and the next run starts from
+    page 0. Otherwise the next run keeps the same run id, retries the failed pages and carries
+    on after the last page that was completed in order.
+    """
+
+    def __init__(self, conn, retailer, page_count):
+        self.conn = conn
+        self.retailer = retailer
+        self.page_count = page_count
+
+        state = get_crawl_state(conn, retailer)
+        if state is not None and state['status'] != 'complete':
+            self.run_id = state['run_id']
+            self.last_completed_page = state['last_completed_page']
+            self.failed_pages = set(state['failed_pages'])
+            logging.info(f"{retailer}: resuming run {self.run_id} after page {self.last_completed_page}, "
+                         f"retrying {len(self.failed_pages)} failed page(s).")
+        else:
+            self.run_id = uuid.uuid4().hex
+            self.last_completed_page = -1
+            self.failed_pages = set()
+
+        # Pages after last_completed_page that finished out of order
+        self.finished = set()
+
+    def pages(self):
+        """Returns the pages this run still has to crawl: the failed pages first, then the rest in order."""
+        remaining = range(self.last_completed_page + 1, self.page_count)
+        return sorted(self.failed_pages) + [page for page in remaining if page not in self.failed_pages]
+
+    def start(self):
+        self.save('running')
+
+    def record(self, page_number, products):
+        """Records a scraped page; products is None when the page failed."""
+        if products is None:
+            self.failed_pages.add(page_number)
+        else:
+            self.failed_pages.discard(page_number)
+
+        # Failed pages still move the frontier on: they are tracked in failed_pages instead
+        if page_number > self.last_completed_page:
+            self.finished.add(page_number)
+        while self.last_completed_page + 1 in self.finished:
+            self.last_completed_page += 1
+            self.finished.discard(self.last_completed_page)
+
+        self.save('running')
+
+    def end_at(self, page_number):
+        """Records that the catalogue ends at page_number, so the pages after it aren't waited for or retried."""
+        self.page_count = page_number + 1
+        self.failed_pages = set(page for page in self.failed_pages if page <= page_number)
+        self.save('running')
+
+    def finish(self):
+        """Marks the run complete, unless pages failed or the crawl stopped before the last page."""
+        done = not self.failed_pages and self.last_completed_page >= self.page_count - 1
+        self.save('complete' if done else 'incomplete')
+        if not done:
+            logging.warning(f"{self.retailer}: run {self.run_id} is incomplete, "
+                            f"{len(self.failed_pages)} failed page(s) will be retried on the next run.")
+
+    def save(self, status):
+        save_crawl_state(self.conn, self.retailer, self.run_id, self.last_completed_page, self.failed_pages, status)
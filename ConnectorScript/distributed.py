@@ -0,0 +1,294 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'DatabaseScripts')))
+from database import DEFAULT_DB_PATH, create_connection, create_table, close_connection#type:ignore
+from matching import match_new_products#type:ignore
+from stats import refresh_summary_tables#type:ignore
+from work_queue import DEFAULT_LEASE_SECONDS, DEFAULT_QUEUE_PATH, TaskQueue#type:ignore
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'WebScrappingScripts')))
+from http_fetch import HttpBackend#type:ignore
+from metrics import increment, profile_page, registry, timer#type:ignore
+from page_archive import RETAILER_MODULES#type:ignore
+from rate_limiter import get_rate_limiter, set_rate_limiter#type:ignore
+from main import log_time_breakdown, record_run, write_page
+import argparse
+import importlib
+import logging
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+# Logging setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Seconds an idle worker or writer waits before looking at the queue again
+POLL_SECONDS = 5
+
+# Submitted pages the writer stores before checking the queue again
+WRITER_BATCH = 100
+
+def enqueue_crawl(task_queue, retailers):
+    """Queues a task for every listing page of each retailer (by module name)."""
+    for retailer in retailers:
+        scraper = importlib.import_module(retailer).RETAILER
+        pages = [(page, scraper.page_url(page)) for page in range(scraper.page_count())]
+        logging.info(f"{retailer}: queued {task_queue.enqueue(retailer, pages)} of {len(pages)} page(s).")
+
+class Heartbeat:
+    """Renews a task's lease from a background thread while the worker is busy with it."""
+
+    def __init__(self, task_queue, task, worker_id, lease_seconds):
+        self.task_queue = task_queue
+        self.task = task
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{task['id']}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            if not self.task_queue.heartbeat(self.task['id'], self.worker_id, self.lease_seconds):
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+class SharedRateLimiter:
+    """
+    Wraps a host's adaptive rate limiter so its request slots come from the queue database, shared
+    by every worker, instead of from this process alone. Each worker still adapts the rate from the
+    pages it loads itself; the slots are spaced by that rate.
+    """
+
+    def __init__(self, task_queue, host, limiter):
+        self.task_queue = task_queue
+        self.host = host
+        self.limiter = limiter
+
+    def acquire(self):
+        wait = self.task_queue.reserve_slot(self.host, 1 / self.limiter.rate)
+        if wait > 0:
+            time.sleep(wait)
+
+    def record(self, elapsed, ok=True):
+        self.limiter.record(elapsed, ok)
+
+def share_rate_limiter(task_queue, url, rate_limit):
+    """Makes the limiter for url's host, in this process, take its request slots from the queue."""
+    limiter = get_rate_limiter(url, rate_limit)
+    if not isinstance(limiter, SharedRateLimiter):
+        limiter = set_rate_limiter(url, limiter=SharedRateLimiter(task_queue, urlparse(url).netloc, limiter))
+    return limiter
+
+def scrape_task(task, drivers, backend):
+    """
+    Scrapes one task's page with its retailer's module: over HTTP with parse_product_info when
+    a backend is given, and otherwise, or when the grid isn't in the HTML, in Chrome with
+    scrape_page, which loads the page and runs extract_product_info.
+
+    Returns:
+        list of dict: The products, or None if the page couldn't be loaded.
+    """
+    retailer = task['retailer']
+    scraper = importlib.import_module(retailer).RETAILER
+    limiter = get_rate_limiter(task['url'], scraper.rate_limit)  # Shared through the queue by run_worker
+    with timer("rate_limit_wait_seconds", retailer=retailer):
+        limiter.acquire()
+
+    products = None
+    with profile_page(retailer, task['page']):
+        if backend is not None:
+            with timer("page_seconds", retailer=retailer, fetch="http"):
+                started = time.monotonic()
+                try:
+                    with timer("stage_seconds", retailer=retailer, stage="download"):
+                        html = backend.fetch(task['url'])
+                except Exception:
+                    limiter.record(time.monotonic() - started, ok=False)
+                    raise
+                limiter.record(time.monotonic() - started)
+                with timer("stage_seconds", retailer=retailer, stage="extract"):
+                    products = scraper.parse_product_info(html)
+        if products is None:
+            if retailer not in drivers:
+                drivers[retailer] = scraper.create_driver()
+            started = time.monotonic()
+            try:
+                # scrape_page reports its own page loads to the limiter
+                with timer("page_seconds", retailer=retailer, fetch="browser"):
+                    products = scraper.scrape_page(drivers[retailer], task['page'])
+            except Exception:
+                limiter.record(time.monotonic() - started, ok=False)
+                # The browser may be what broke; the next task gets a fresh one
+                drivers.pop(retailer).quit()
+                raise
+    return products
+
+def run_worker(task_queue, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS, use_http=False, backend=None, wait=False, retailers=None):
+    """
+    Claims and scrapes tasks one at a time until the queue has nothing left for it (or forever
+    with wait=True). Keeps no state of its own beyond a browser per retailer, so any number of
+    workers can run on any number of machines against the same queue.
+    """
+    logging.info(f"Worker {worker_id} started.")
+    drivers = {}
+    own_backend = use_http and backend is None
+    if own_backend:
+        backend = HttpBackend()
+    done = 0
+    try:
+        while True:
+            tasks = task_queue.claim(worker_id, lease_seconds, retailers=retailers)
+            if not tasks:
+                counts = task_queue.counts()
+                if not wait and counts['queued'] == 0 and counts['leased'] == 0:
+                    break
+                time.sleep(POLL_SECONDS)  # Tasks waiting out a retry back-off, or leased to others
+                continue
+
+            task = tasks[0]
+            share_rate_limiter(task_queue, task['url'], importlib.import_module(task['retailer']).RETAILER.rate_limit)
+            logging.info(f"Worker {worker_id}: {task['retailer']} page {task['page']} (attempt {task['attempts']})")
+            error = "the page couldn't be loaded"
+            with Heartbeat(task_queue, task, worker_id, lease_seconds) as heartbeat:
+                try:
+                    products = scrape_task(task, drivers, backend if use_http else None)
+                except Exception as e:
+                    products, error = None, e
+
+            # A lost lease means the task may be with another worker by now, so its result is dropped
+            if heartbeat.lost:
+                result = "lease_lost"
+            elif products is not None:
+                owned = task_queue.complete(task['id'], worker_id, task['retailer'], task['page'], products)
+                result = "done" if owned else "lease_lost"
+            else:
+                result = task_queue.fail(task['id'], worker_id, error) or "lease_lost"
+                if result != "lease_lost":
+                    logging.warning(f"{task['retailer']} page {task['page']} failed ({error}); task is now {result}.")
+
+            if result == "lease_lost":
+                logging.warning(f"Worker {worker_id} lost the lease on {task['retailer']} page {task['page']}; dropping it.")
+            elif result == "done":
+                done += 1
+            increment("tasks_total", retailer=task['retailer'], result=result)
+    finally:
+        for driver in drivers.values():
+            driver.quit()
+        if own_backend:
+            backend.close()
+    logging.info(f"Worker {worker_id} finished after {done} page(s).")
+    if done:
+        log_time_breakdown(registry.snapshot())
+    return done
+
+def finish_batch(conn, task_queue, started_at, started):
+    """Records a drained batch of pages: quarantined pages, matching, summary tables and the run summary."""
+    for task in task_queue.quarantined():
+        logging.warning(f"Quarantined: {task['retailer']} page {task['page']} after {task['attempts']} attempts: {task['last_error']}")
+        increment("pages_stored_total", retailer=task['retailer'], result="failed")
+    with timer("post_process_seconds", step="match_products"):
+        logging.info(f"Product matching: {match_new_products(conn)}")
+    with timer("post_process_seconds", step="refresh_summary_tables"):
+        logging.info(f"Summary tables refreshed for: {refresh_summary_tables(conn)}")
+    record_run(conn, "distributed", started_at, time.monotonic() - started)
+
+def run_writer(task_queue, conn, wait=False):
+    """
+    The only process that writes products: stores the pages workers submit, then runs matching
+    and the summary refresh and records the run once the queue is drained. With wait=True it
+    keeps going, recording a run each time the queue goes quiet after new pages.
+    """
+    registry.reset()
+    started_at, started, stored = None, None, 0
+    while True:
+        results = task_queue.take_results(WRITER_BATCH)
+        if results:
+            if started is None:
+                started_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                started = time.monotonic()
+            for result_id, retailer, page, products in results:
+                write_page(conn, retailer, page, products)
+                increment("pages_stored_total", retailer=retailer, result="ok")
+            # Deleted only once stored; a crash in between stores them again, which write_page skips
+            task_queue.delete_results([result[0] for result in results])
+            stored += len(results)
+            continue
+
+        counts = task_queue.counts()
+        drained = counts['queued'] == 0 and counts['leased'] == 0 and counts['results'] == 0
+        if drained and started is not None:
+            logging.info(f"Stored {stored} page(s) from the queue: {counts}")
+            finish_batch(conn, task_queue, started_at, started)
+            registry.reset()
+            started_at, started, stored = None, None, 0
+        if drained and not wait:
+            return
+        time.sleep(POLL_SECONDS)
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl listing pages with any number of workers sharing a page queue.")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="the SQLite queue file every worker and the writer use")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = commands.add_parser("enqueue", help="queue every listing page of the given retailers")
+    enqueue_parser.add_argument("retailers", nargs="*", help=f"retailers to crawl, from {', '.join(RETAILER_MODULES)} (default: all)")
+
+    worker_parser = commands.add_parser("worker", help="claim and scrape pages until the queue is empty")
+    worker_parser.add_argument("--id", default=None, help="worker name used for leases (default: host, pid and a random suffix)")
+    worker_parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS, help="seconds a claimed page is held without a heartbeat")
+    worker_parser.add_argument("--http", action="store_true", help="download pages over HTTP, only using Chrome where the product grid is missing")
+    worker_parser.add_argument("--wait", action="store_true", help="keep waiting for new tasks instead of exiting when the queue is empty")
+    worker_parser.add_argument("--retailer", action="append", help="only claim this retailer's pages (repeatable)")
+    worker_parser.add_argument("--offline", action="store_true", help="never check online for a chromedriver; use the cached one or the one on the PATH")
+
+    writer_parser = commands.add_parser("writer", help="store the pages workers submit in the products database")
+    writer_parser.add_argument("--wait", action="store_true", help="keep storing new pages instead of exiting when the queue is drained")
+
+    status_parser = commands.add_parser("status", help="show task counts and quarantined pages")
+    status_parser.add_argument("--release-quarantined", action="store_true", help="put quarantined pages back on the queue")
+
+    args = parser.parse_args()
+    task_queue = TaskQueue(args.queue)
+    try:
+        if args.command == "enqueue":
+            unknown = set(args.retailers) - set(RETAILER_MODULES)
+            if unknown:
+                parser.error(f"unknown retailer(s): {', '.join(sorted(unknown))}")
+            enqueue_crawl(task_queue, args.retailers or RETAILER_MODULES)
+        elif args.command == "worker":
+            if args.offline:
+                os.environ["SCRAPER_OFFLINE"] = "1"  # Read by driver_factory
+            run_worker(task_queue, args.id or default_worker_id(), args.lease, use_http=args.http, wait=args.wait,
+                       retailers=args.retailer)
+        elif args.command == "writer":
+            conn = create_connection(DEFAULT_DB_PATH)
+            if conn is None:
+                logging.error("Failed to create database connection. Exiting.")
+                sys.exit(1)
+            create_table(conn)
+            try:
+                run_writer(task_queue, conn, wait=args.wait)
+            finally:
+                close_connection(conn)
+        else:
+            if args.release_quarantined:
+                logging.info(f"Released {task_queue.release_quarantined()} quarantined page(s).")
+            print(task_queue.counts())
+            for task in task_queue.quarantined():
+                print(f"quarantined: {task['retailer']} page {task['page']} ({task['attempts']} attempts): {task['last_error']}")
+    finally:
+        task_queue.close()
@@ -1,58 +1,275 @@
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'DatabaseScripts')))
-from database import create_connection, create_table, update_or_insert_product, close_connection#type:ignore
+from database import DEFAULT_DB_PATH, create_connection, create_table, create_crawl_state_table, fingerprint_products, get_page_fingerprint, save_catalogue_size, save_page_fingerprint, save_scrape_run, upsert_products, close_connection#type:ignore
+from matching import match_new_products#type:ignore
+from stats import refresh_summary_tables#type:ignore
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'WebScrappingScripts')))
-from checkers import main as checkers#type:ignore
-from picknpay import main as pnp#type:ignore
-from woolworths import main as woolworths#type:ignore
+import checkers#type:ignore
+import picknpay#type:ignore
+import woolworths#type:ignore
+from driver_factory import quit_shared_driver#type:ignore
+from metrics import increment, registry, timer#type:ignore
+from retailer_engine import is_last_page#type:ignore
+from checkpoint import CrawlCheckpoint
+import argparse
 import logging
+import multiprocessing
+import queue
+import time
+from datetime import datetime, timezone
 
 # Logging setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def main():
-    # connect to the database
-    conn = create_connection('products.db')
+# Retailer definitions in the order they run in sequential mode, keyed by the name used in the logs
+SCRAPERS = {
+    "Woolworths": woolworths.RETAILER,
+    "Checkers": checkers.RETAILER,
+    "PnP": picknpay.RETAILER,
+}
+
+# How many of the run's timings are logged in its time breakdown
+BREAKDOWN_LINES = 15
+
+def new_counts():
+    """Returns an empty tally of upsert results."""
+    return {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+
+def add_counts(totals, counts):
+    """Adds one batch's upsert results to a running tally."""
+    for key, value in counts.items():
+        totals[key] += value
+
+def write_page(conn, retailer, page_number, products):
+    """
+    Upserts a scraped page's products, unless they are exactly the products stored from that
+    page last time, in which case the page is skipped without any writes.
+
+    Returns:
+        dict: The upsert counts, or None if the page was unchanged and skipped.
+    """
+    fingerprint = fingerprint_products(products)
+    if get_page_fingerprint(conn, retailer, page_number) == fingerprint:
+        increment("pages_skipped_total", retailer=retailer)
+        return None
+
+    with timer("db_write_seconds", retailer=retailer, table="products"):
+        counts = upsert_products(conn, products)  # One transaction per page
+    for result, count in counts.items():
+        increment("products_written_total", count, retailer=retailer, result=result)
+    # A batch rolled back by an error comes back with nothing counted; it has to be written again next time
+    if sum(counts.values()) == len(products):
+        save_page_fingerprint(conn, retailer, page_number, fingerprint, len(products))
+    return counts
+
+def store_page(conn, checkpoint, totals, page_number, products):
+    """Writes one scraped page to the database and moves the retailer's checkpoint on.
+
+    Returns the number of products found on the page.
+    """
+    retailer = SCRAPERS[checkpoint.retailer].name  # The name the scraper's own metrics use
+    if products is not None:
+        counts = write_page(conn, retailer, page_number, products)
+        if counts is not None:
+            add_counts(totals, counts)
+    with timer("db_write_seconds", retailer=retailer, table="crawl_state"):
+        checkpoint.record(page_number, products)
+        if is_last_page(products):
+            checkpoint.end_at(page_number)
+    increment("pages_stored_total", retailer=retailer, result="ok" if products is not None else "failed")
+    return len(products) if products is not None else 0
+
+def save_page_count(conn, name, page_count):
+    """Saves the catalogue size a crawl found at the end, if it got there, for the refresh scheduler to size its schedule by."""
+    if page_count is not None:
+        save_catalogue_size(conn, SCRAPERS[name].name, page_count)
+
+def run_sequential(conn, options):
+    """Run the scrapers one after another, storing each page's products as soon as it is scraped.
+
+    options are passed to every scraper's iter_pages(), e.g. workers and use_http.
+    Each retailer resumes from its saved checkpoint if its last run didn't complete.
+    """
+    for name, scraper in SCRAPERS.items():
+        found = 0
+        totals = new_counts()
+        checkpoint = CrawlCheckpoint(conn, name, scraper.page_count())
+        try:
+            logging.info(f"Running {name} scraper...")
+            checkpoint.start()
+            for page_number, products in scraper.iter_pages(checkpoint.pages(), follow_to_end=True, **options):
+                found += store_page(conn, checkpoint, totals, page_number, products)
+            logging.info(f"{name} scraper completed: {found} products found.")
+            save_page_count(conn, name, scraper.known_page_count())
+        except Exception as e:
+            logging.error(f"{name} scraper failed: {e}")
+        checkpoint.finish()
+        logging.info(f"{name} database write: {totals}")
+
+def scraper_worker(name, results, page_numbers, options):
+    """
+    Runs a single scraper in its own process and streams its pages back to the writer.
+
+    Every message on the results queue is a (kind, name, payload) tuple where kind is
+    'page' (with a (page_number, products) payload), 'metrics' (a metrics snapshot of the
+    process's timings and counts, sent just before the last message), 'done' (with the products
+    found and the catalogue's page count, if the crawl reached the end) or 'error'.
+    Each process starts its own Chrome through the scraper.
+    """
+    registry.reset()  # Only this retailer's metrics go back to the writer
+    try:
+        logging.info(f"Running {name} scraper...")
+        found = 0
+        for page_number, products in SCRAPERS[name].iter_pages(page_numbers, follow_to_end=True, **options):
+            results.put(("page", name, (page_number, products)))  # One message per scraped page
+            found += len(products) if products is not None else 0
+        outcome = ("done", name, (found, SCRAPERS[name].known_page_count()))
+    except Exception as e:
+        outcome = ("error", name, str(e))
+    finally:
+        quit_shared_driver()
+    results.put(("metrics", name, registry.snapshot()))
+    results.put(outcome)
+
+def run_concurrent(conn, options):
+    """
+    Run every scraper in its own worker process at the same time.
+
+    This process is the only database writer: it drains the results queue and upserts
+    each batch as it arrives, keeping every retailer's checkpoint up to date.
+    A failing retailer is logged and doesn't stop the others.
+    """
+    results = multiprocessing.Queue()
+    processes = {}
+    checkpoints = {}
+    for name, scraper in SCRAPERS.items():
+        checkpoints[name] = CrawlCheckpoint(conn, name, scraper.page_count())
+        checkpoints[name].start()
+        process = multiprocessing.Process(target=scraper_worker, args=(name, results, checkpoints[name].pages(), options),
+                                          name=f"{name}-scraper")
+        process.start()
+        processes[name] = process
+
+    pending = set(processes)
+    counts = {name: new_counts() for name in processes}
+
+    while pending:
+        try:
+            kind, name, payload = results.get(timeout=5)
+        except queue.Empty:
+            # A worker that died without reporting (e.g. killed by the OS) would otherwise hang the writer
+            for name in list(pending):
+                if not processes[name].is_alive() and results.empty():
+                    logging.error(f"{name} scraper failed: worker exited with code {processes[name].exitcode}")
+                    checkpoints[name].finish()
+                    pending.discard(name)
+            continue
+
+        if kind == "page":
+            page_number, products = payload
+            store_page(conn, checkpoints[name], counts[name], page_number, products)
+        elif kind == "metrics":
+            registry.merge(payload)
+        elif kind == "done":
+            found, page_count = payload
+            logging.info(f"{name} scraper completed: {found} products found.")
+            save_page_count(conn, name, page_count)
+            logging.info(f"{name} database write: {counts[name]}")
+            checkpoints[name].finish()
+            pending.discard(name)
+        else:
+            logging.error(f"{name} scraper failed: {payload}")
+            logging.info(f"{name} database write: {counts[name]}")
+            checkpoints[name].finish()
+            pending.discard(name)
+
+    for process in processes.values():
+        process.join()
+
+def log_time_breakdown(snapshot):
+    """Logs where the run's time went: the total seconds of each timed stage, largest first."""
+    timings = sorted(snapshot['histograms'], key=lambda entry: entry['sum'], reverse=True)
+    logging.info("Time breakdown (stages overlap: a page's time includes its stages):")
+    for entry in timings[:BREAKDOWN_LINES]:
+        labels = ', '.join(f"{key}={value}" for key, value in sorted(entry['labels'].items()))
+        logging.info(f"  {entry['name']} [{labels}]: {entry['sum']:.1f}s over {entry['count']}, "
+                     f"mean {entry['sum'] / entry['count']:.3f}s")
+
+def record_run(conn, mode, started_at, duration):
+    """Writes the run's summary and metrics to the scrape_runs table and logs them."""
+    snapshot = registry.snapshot()
+    run = {
+        'started_at': started_at,
+        'finished_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        'duration_seconds': round(duration, 3),
+        'mode': mode,
+        'pages': registry.total("pages_stored_total"),
+        'failed_pages': registry.total("pages_stored_total", result="failed"),
+        'products': registry.total("products_written_total"),
+        'skipped_pages': registry.total("pages_skipped_total"),
+        'metrics': snapshot,
+    }
+    for result in new_counts():
+        run[result] = registry.total("products_written_total", result=result)
+
+    log_time_breakdown(snapshot)
+    logging.info(f"Run summary: {dict((key, value) for key, value in run.items() if key != 'metrics')}")
+    save_scrape_run(conn, run)
+
+def main(concurrent=False, **options):
+    # connect to the database, the same file the API reads whatever directory this runs from
+    conn = create_connection(DEFAULT_DB_PATH)
     if conn is None:
         logging.error("Failed to create database connection. Exiting.")
         return
 
-    #  Create the products table
+    # Time and count everything from here on; the summary is saved to scrape_runs at the end
+    registry.reset()
+    started_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    started = time.monotonic()
+
+    #  Create the products and crawl checkpoint tables
     create_table(conn)
+    create_crawl_state_table(conn)
 
-    #  Run the web scrapers and te store data in the database
+    #  Run the web scrapers and store the data in the database
+    if concurrent:
+        run_concurrent(conn, options)
+    else:
+        run_sequential(conn, options)
 
-    try:
-        logging.info("Running Woolworths scraper...")
-        woolworths_products = woolworths()  # Run Woolworths scraper
-        for product in woolworths_products:
-            update_or_insert_product(conn, product)
-        logging.info(f"Woolworths scraper completed: {len(woolworths_products)} products found.")
-    except Exception as e:
-        logging.error(f"Woolworths scraper failed: {e}")
+    # The retailers share one browser in sequential mode; close it now they're all done
+    quit_shared_driver()
 
-    try:
-        logging.info("Running Checkers scraper...")
-        checkers_products = checkers()  # Run Checkers scraper
-        for product in checkers_products:
-            update_or_insert_product(conn, product)
-        logging.info(f"Checkers scraper completed: {len(checkers_products)} products found.")
-    except Exception as e:
-        logging.error(f"Checkers scraper failed: {e}")
+    # Link the products scraped for the first time to the same items at the other retailers
+    with timer("post_process_seconds", step="match_products"):
+        logging.info(f"Product matching: {match_new_products(conn)}")
+
+    # Bring the /stats summaries up to date for the sources this run changed
+    with timer("post_process_seconds", step="refresh_summary_tables"):
+        logging.info(f"Summary tables refreshed for: {refresh_summary_tables(conn)}")
+
+    record_run(conn, "concurrent" if concurrent else "sequential", started_at, time.monotonic() - started)
 
-   
-    try:
-        logging.info("Running PnP scraper...")
-        pnp_products = pnp()  # Run PnP scraper
-        for product in pnp_products:
-            update_or_insert_product(conn, product)
-        logging.info(f"PnP scraper completed: {len(pnp_products)} products found.")
-    except Exception as e:
-        logging.error(f"PnP scraper failed: {e}")
-    
     # Close the database connection
     close_connection(conn)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Scrape all retailers and store the products in the database.")
+    parser.add_argument("--concurrent", action="store_true", help="run each retailer in its own process at the same time")
+    parser.add_argument("--workers", type=int, default=1, help="number of headless browsers each retailer crawls with")
+    parser.add_argument("--http", action="store_true", help="download listing pages over HTTP, only using Chrome where the product grid is missing")
+    parser.add_argument("--offline", action="store_true", help="never check online for a chromedriver; use the cached one or the one on the PATH")
+    parser.add_argument("--archive", nargs="?", const="1", metavar="DIR",
+                        help="save every listing page's HTML to the page archive (WebScrappingScripts/page_archive by default) for offline re-parsing")
+    parser.add_argument("--profile-slow-pages", type=float, metavar="SECONDS",
+                        help="sample the stack of every page and keep the profile of pages slower than this (in WebScrappingScripts/profiles)")
+    args = parser.parse_args()
+    if args.profile_slow_pages:
+        os.environ["SCRAPER_PROFILE_SLOW_PAGES"] = str(args.profile_slow_pages)  # Read by metrics, and inherited by worker processes
+    if args.offline:
+        os.environ["SCRAPER_OFFLINE"] = "1"  # Read by driver_factory, and inherited by worker processes
+    if args.archive:
+        os.environ["SCRAPER_ARCHIVE_DIR"] = args.archive  # Read by page_archive, and inherited by worker processes
+    main(concurrent=args.concurrent, workers=args.workers, use_http=args.http)
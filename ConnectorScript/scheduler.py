@@ -0,0 +1,253 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'DatabaseScripts')))
+from database import DEFAULT_DB_PATH, create_connection, create_table, count_recent_page_visits, get_catalogue_size, get_page_stats, save_catalogue_size, save_page_stats, close_connection#type:ignore
+from matching import match_new_products#type:ignore
+from stats import refresh_summary_tables#type:ignore
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'WebScrappingScripts')))
+from driver_factory import quit_shared_driver#type:ignore
+from metrics import increment, registry, timer#type:ignore
+from retailer_engine import catalogue_page_count, is_last_page#type:ignore
+from main import SCRAPERS, record_run, write_page
+import argparse
+import logging
+import math
+import time
+from datetime import datetime, timezone
+
+# Logging setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Page loads per hour shared by every retailer, unless --budget says otherwise
+DEFAULT_PAGE_BUDGET = 20
+
+# Most pages scraped before the schedule is looked at again
+BATCH_SIZE = 20
+
+# Shortest and longest time between two visits to a page, in hours. The minimum also keeps the
+# hourly budget exact, since it is counted from each page's last visit
+MIN_INTERVAL_HOURS = 1
+MAX_INTERVAL_HOURS = 7 * 24
+
+# Changes per hour assumed for a page that hasn't been revisited yet, and the lowest rate any page
+# is given, so a page that has never changed is still checked now and then
+PRIOR_CHANGE_RATE = 1 / 24
+MIN_CHANGE_RATE = 1 / (30 * 24)
+
+# Weight kept by a page's earlier visits each time it is revisited, so the rate follows the site
+DECAY = 0.9
+
+# Seconds to wait when no page is due or the hour's budget is spent
+IDLE_SECONDS = 60
+
+def estimate_change_rate(stats):
+    """
+    Estimates how many times per hour a page changes from its revisits.
+
+    A revisit only shows whether the page changed at least once since the last one, so the
+    plain changes / hours ratio underestimates busy pages. This uses the Poisson estimator
+    -log((n - X + 0.5) / (n + 0.5)) / (T / n), where n is the revisits, X those that found a
+    change and T the hours they covered.
+    """
+    visits, changes, hours = stats['visits'], stats['changes'], stats['observed_hours']
+    if visits <= 0 or hours <= 0:
+        return PRIOR_CHANGE_RATE
+    rate = -math.log((visits - changes + 0.5) / (visits + 0.5)) / (hours / visits)
+    return max(MIN_CHANGE_RATE, rate)
+
+def new_page_stats(retailer, page):
+    """Returns the stats of a page that has never been visited."""
+    return {'retailer': retailer, 'page': page, 'visits': 0, 'changes': 0, 'observed_hours': 0,
+            'change_rate': None, 'last_visited_at': None, 'last_changed_at': None}
+
+def record_visit(stats, changed, now):
+    """
+    Adds a visit to a page's stats. The first visit only sets the starting point: what it found
+    can't be told apart from changes made before the page was being tracked.
+    """
+    stats = dict(stats)
+    if stats['last_visited_at'] is not None:
+        stats['visits'] = stats['visits'] * DECAY + 1
+        stats['changes'] = stats['changes'] * DECAY + (1 if changed else 0)
+        stats['observed_hours'] = stats['observed_hours'] * DECAY + (now - stats['last_visited_at']) / 3600
+        stats['change_rate'] = estimate_change_rate(stats)
+    if changed:
+        stats['last_changed_at'] = now
+    stats['last_visited_at'] = now
+    return stats
+
+def plan_intervals(rates, budget):
+    """
+    Spreads an hourly page budget over the pages, returning the hours between visits for each.
+
+    Each page is visited in proportion to the square root of its change rate: volatile pages
+    are visited more often, but not so much more that the static ones go stale. Intervals are
+    kept between MIN_INTERVAL_HOURS and MAX_INTERVAL_HOURS.
+
+    Args:
+        rates (dict): Estimated changes per hour, by page key.
+        budget (float): Page loads per hour.
+    """
+    weights = {key: math.sqrt(rate) for key, rate in rates.items()}
+    total = sum(weights.values())
+    intervals = {}
+    for key, weight in weights.items():
+        visits_per_hour = budget * weight / total
+        intervals[key] = min(MAX_INTERVAL_HOURS, max(MIN_INTERVAL_HOURS, 1 / visits_per_hour))
+    return intervals
+
+def schedule_page_count(conn, scraper):
+    """
+    Returns how many of a retailer's pages to schedule. Once a crawl has reached the end of the
+    catalogue that is its size then plus the page after it, which shows when the catalogue grows;
+    until then, the scraper's own page count.
+    """
+    page_count = get_catalogue_size(conn, scraper.name)
+    return page_count + 1 if page_count is not None else scraper.page_count()
+
+def load_schedule(conn):
+    """Returns the stats of every page in the retailers' current catalogues, keyed by (scraper name, page)."""
+    schedule = {}
+    for name, scraper in SCRAPERS.items():
+        known = get_page_stats(conn, scraper.name)
+        for page in range(schedule_page_count(conn, scraper)):
+            schedule[(name, page)] = known.get(page) or new_page_stats(scraper.name, page)
+    return schedule
+
+def due_pages(schedule, budget, now, limit):
+    """
+    Returns up to limit (scraper name, page) keys that are due a visit, most overdue first.
+
+    Pages that have never been visited come first, in page order; then pages by how many of
+    their intervals have passed since their last visit.
+    """
+    rates = {key: stats['change_rate'] or PRIOR_CHANGE_RATE for key, stats in schedule.items()}
+    intervals = plan_intervals(rates, budget)
+    overdue = []
+    for key, stats in schedule.items():
+        if stats['last_visited_at'] is None:
+            overdue.append((math.inf, key))
+            continue
+        elapsed = (now - stats['last_visited_at']) / 3600
+        if elapsed >= intervals[key]:
+            overdue.append((elapsed / intervals[key], key))
+    overdue.sort(key=lambda item: (-item[0], item[1]))
+    return [key for _, key in overdue[:limit]]
+
+def visit_pages(conn, name, schedule, pages, options):
+    """
+    Scrapes the given pages of one retailer, stores their products and updates their stats.
+
+    The end of the catalogue is saved whenever a page shows it, or moved on when a page at or past
+    the saved end comes back full. Pages the crawl dropped after the end still count as visited,
+    so they aren't picked again in the next batch.
+    """
+    scraper = SCRAPERS[name]
+    retailer = scraper.name
+    logging.info(f"Revisiting {len(pages)} {name} page(s): {pages}")
+    saved_count = get_catalogue_size(conn, retailer)
+    end = None
+    try:
+        for page_number, products in scraper.iter_pages(pages, **options):
+            now = time.time()
+            if is_last_page(products):
+                end = page_number
+                save_catalogue_size(conn, retailer, catalogue_page_count(page_number, products))
+            elif products and saved_count is not None and page_number >= saved_count:
+                # The page after the saved end has products now: the catalogue has grown
+                saved_count = page_number + 1
+                save_catalogue_size(conn, retailer, saved_count)
+            if products is None:
+                # Still counts against the budget, but says nothing about how often the page changes
+                increment("pages_stored_total", retailer=retailer, result="failed")
+                stats = dict(schedule[(name, page_number)], last_visited_at=now)
+            else:
+                counts = write_page(conn, retailer, page_number, products)  # None for an unchanged page
+                increment("pages_stored_total", retailer=retailer, result="ok")
+                changed = counts is not None and counts['inserted'] + counts['updated'] > 0
+                increment("scheduled_visits_total", retailer=retailer, result="changed" if changed else "unchanged")
+                stats = record_visit(schedule[(name, page_number)], changed, now)
+            save_page_stats(conn, stats)
+            schedule[(name, page_number)] = stats
+    except Exception as e:
+        logging.error(f"{name} scraper failed: {e}")
+
+    if end is not None:
+        now = time.time()
+        for page_number in pages:
+            if page_number > end:
+                # Not loaded, so like a failed page it says nothing about how often the page changes
+                stats = dict(schedule[(name, page_number)], last_visited_at=now)
+                save_page_stats(conn, stats)
+                schedule[(name, page_number)] = stats
+
+def run_batch(conn, budget, options):
+    """
+    Visits the pages that are due, within what is left of the hour's budget.
+
+    Returns:
+        int: The number of pages visited.
+    """
+    now = time.time()
+    remaining = int(budget) - count_recent_page_visits(conn, now - 3600)
+    if remaining <= 0:
+        return 0
+    schedule = load_schedule(conn)
+    due = due_pages(schedule, budget, now, min(remaining, BATCH_SIZE))
+    if not due:
+        return 0
+
+    registry.reset()
+    started_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    started = time.monotonic()
+    for name in SCRAPERS:
+        pages = sorted(page for scraper_name, page in due if scraper_name == name)
+        if pages:
+            visit_pages(conn, name, schedule, pages, options)
+
+    if registry.total("products_written_total", result="inserted") or registry.total("products_written_total", result="updated"):
+        with timer("post_process_seconds", step="match_products"):
+            logging.info(f"Product matching: {match_new_products(conn)}")
+        with timer("post_process_seconds", step="refresh_summary_tables"):
+            logging.info(f"Summary tables refreshed for: {refresh_summary_tables(conn)}")
+    record_run(conn, "scheduled", started_at, time.monotonic() - started)
+    return len(due)
+
+def main(budget=DEFAULT_PAGE_BUDGET, once=False, **options):
+    """
+    Keeps the products fresh by revisiting listing pages as they become due, instead of
+    crawling every page on every run. Runs until interrupted, or for one batch with once=True.
+    """
+    conn = create_connection(DEFAULT_DB_PATH)
+    if conn is None:
+        logging.error("Failed to create database connection. Exiting.")
+        return
+    create_table(conn)
+
+    logging.info(f"Refresh scheduler started with a budget of {budget} pages per hour.")
+    try:
+        while True:
+            visited = run_batch(conn, budget, options)
+            if once:
+                break
+            if not visited:
+                time.sleep(IDLE_SECONDS)
+    except KeyboardInterrupt:
+        logging.info("Refresh scheduler stopped.")
+    finally:
+        quit_shared_driver()
+        close_connection(conn)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Revisit listing pages as they become due, volatile pages more often than static ones.")
+    parser.add_argument("--budget", type=float, default=DEFAULT_PAGE_BUDGET, help="page loads per hour across all retailers")
+    parser.add_argument("--once", action="store_true", help="visit one batch of due pages and exit")
+    parser.add_argument("--workers", type=int, default=1, help="number of headless browsers each retailer crawls with")
+    parser.add_argument("--http", action="store_true", help="download listing pages over HTTP, only using Chrome where the product grid is missing")
+    parser.add_argument("--offline", action="store_true", help="never check online for a chromedriver; use the cached one or the one on the PATH")
+    args = parser.parse_args()
+    if args.budget <= 0:
+        parser.error("--budget must be above 0")
+    if args.offline:
+        os.environ["SCRAPER_OFFLINE"] = "1"  # Read by driver_factory
+    main(budget=args.budget, once=args.once, workers=args.workers, use_http=args.http)
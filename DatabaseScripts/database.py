@@ -1,15 +1,127 @@
+import hashlib
+import json
+import os
+import queue
+import re
 import sqlite3
 
-def create_connection(db_file):
-    """Create a database connection to the SQLite database specified by db_file."""
+# A price such as "R 52.99", "R1 299.00" or "R 1,299.99": rands with optional thousands separators, then cents
+PRICE_PATTERN = re.compile(r'(\d{1,3}(?:[ ,]\d{3})+|\d+)(?:\.(\d{1,2}))?')
+
+# A pack size in a product name, such as "400 g", "1.5kg", "2 L" or "6 pk"
+PACK_SIZE_PATTERN = re.compile(r'(\d+(?:[.,]\d+)?)\s*(kg|g|ml|l|pk|s)\b', re.IGNORECASE)
+
+def parse_price(price):
+    """Parse a scraped price string into integer cents, or None if it has no number in it."""
+    if not price:
+        return None
+    match = PRICE_PATTERN.search(price)
+    if match is None:
+        return None
+    rands = int(re.sub(r'[ ,]', '', match.group(1)))
+    cents = int((match.group(2) or '0').ljust(2, '0'))
+    return rands * 100 + cents
+
+def parse_pack_size(name):
+    """Parse the pack size from a product name, e.g. "Ciabatta Bread 400 g" -> (400.0, 'g').
+
+    Returns (None, None) when the name has no pack size.
+    """
+    if not name:
+        return None, None
+    match = PACK_SIZE_PATTERN.search(name)
+    if match is None:
+        return None, None
+    return float(match.group(1).replace(',', '.')), match.group(2).lower()
+
+# The one database the scrapers write and the API reads, next to this file unless PRODUCTS_DB says otherwise
+DEFAULT_DB_PATH = os.environ.get('PRODUCTS_DB') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'products.db')
+
+# Applied to every connection. WAL lets readers keep going while the scraper commits, and with WAL
+# synchronous=NORMAL is still safe against corruption; busy_timeout waits out a checkpoint instead of
+# failing with "database is locked".
+CONNECTION_PRAGMAS = [
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',     # 16 MB page cache per connection
+    'PRAGMA mmap_size = 268435456',   # Read through a 256 MB memory map instead of read() calls
+    'PRAGMA temp_store = MEMORY',
+]
+
+# Idle read-only connections kept by a ConnectionPool
+READ_POOL_SIZE = 8
+
+def configure_connection(conn):
+    """Apply the shared pragmas to a new connection."""
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+
+def create_connection(db_file=DEFAULT_DB_PATH):
+    """Create the read-write connection to the SQLite database specified by db_file.
+
+    There should be one of these per database at a time: the writer. It switches the file to WAL,
+    which is persistent, so readers opened afterwards don't block it or get blocked by it.
+    """
     conn = None
     try: # Attempt to connect to the SQLite database
         conn = sqlite3.connect(db_file)
+        conn.execute('PRAGMA journal_mode = WAL')
+        configure_connection(conn)
         return conn
     except sqlite3.Error as e:
         print(f"Error: {e}")
+        if conn is not None:
+            conn.close()
         return None
 
+def create_read_connection(db_file=DEFAULT_DB_PATH):
+    """Create a read-only connection that may be handed between threads (one at a time)."""
+    try:
+        uri = 'file:' + os.path.abspath(db_file).replace('?', '%3f').replace('#', '%23') + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        configure_connection(conn)
+        return conn
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+        return None
+
+class ConnectionPool:
+    """
+    A pool of reusable read-only connections to one database.
+
+    acquire() hands out an idle connection, or opens a new one when they are all busy, so
+    callers never wait on each other; release() keeps up to size idle connections and closes
+    the rest. Safe to share between threads.
+    """
+
+    def __init__(self, db_file=DEFAULT_DB_PATH, size=READ_POOL_SIZE):
+        self.db_file = db_file
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return create_read_connection(self.db_file)
+
+    def release(self, conn):
+        if conn is None:
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
 def create_table(conn):
     """Create the products table if it doesn't already exist."""
     try:
@@ -26,6 +138,118 @@ def create_table(conn):
         conn.commit()
     except sqlite3.Error as e:
         print(f"Error: {e}")
+    migrate_schema(conn)
+
+# Columns returned for a product by the listing queries, in order
+PRODUCT_COLUMNS = ['id', 'image', 'name', 'price', 'source', 'price_cents']
+
+# Sort orders for list_products: the column the keyset is on and whether it runs descending
+PRODUCT_SORTS = {
+    'id': ('id', False),
+    'price': ('price_cents', False),
+    '-price': ('price_cents', True),
+    'name': ('name', False),
+}
+
+def list_products(conn, source=None, min_price_cents=None, max_price_cents=None, sort='id', after=None, limit=50):
+    """
+    Get one page of products using keyset pagination.
+
+    Args:
+        source (str): Only return products from this source.
+        min_price_cents, max_price_cents (int): Inclusive price range.
+        sort (str): One of PRODUCT_SORTS. Sorting by price leaves out products without a parsed price.
+        after (tuple): (sort value, id) of the last product on the previous page, or None for the first page.
+        limit (int): Maximum number of products to return.
+
+    Returns:
+        list of dict: The products on the page, keyed by PRODUCT_COLUMNS.
+    """
+    column, descending = PRODUCT_SORTS[sort]
+    conditions = []
+    params = []
+
+    if source is not None:
+        conditions.append('source = ?')
+        params.append(source)
+    if min_price_cents is not None:
+        conditions.append('price_cents >= ?')
+        params.append(min_price_cents)
+    if max_price_cents is not None:
+        conditions.append('price_cents <= ?')
+        params.append(max_price_cents)
+    if column == 'price_cents':
+        conditions.append('price_cents IS NOT NULL')
+
+    if after is not None:
+        comparison = '<' if descending else '>'
+        if column == 'id':
+            conditions.append(f'id {comparison} ?')
+            params.append(after[1])
+        else:
+            # Row-value comparison lets SQLite seek straight to the cursor in the matching index
+            conditions.append(f'({column}, id) {comparison} (?, ?)')
+            params.extend(after)
+
+    direction = 'DESC' if descending else 'ASC'
+    order = f'id {direction}' if column == 'id' else f'{column} {direction}, id {direction}'
+    where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT {", ".join(PRODUCT_COLUMNS)} FROM products {where} ORDER BY {order} LIMIT ?
+    ''', params + [limit])
+    return [dict(zip(PRODUCT_COLUMNS, row)) for row in cursor.fetchall()]
+
+# Words in a search query; everything else (quotes, operators, punctuation) is dropped
+SEARCH_TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+def build_search_query(text):
+    """
+    Turn free text into an FTS5 query that matches names containing every word,
+    the last one as a prefix so results come up while the user is still typing.
+
+    Returns None when the text has no words in it.
+    """
+    terms = SEARCH_TERM_PATTERN.findall(text or '')
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' AND '.join(quoted)
+
+def search_products(conn, text, source=None, limit=50, offset=0):
+    """
+    Full-text search on product names, best matches first (bm25).
+
+    Args:
+        text (str): The words to look for; the last one may be a prefix.
+        source (str): Only return products from this source.
+        limit (int): Maximum number of products to return.
+        offset (int): Number of matches to skip, for later pages.
+
+    Returns:
+        list of dict: The matching products, keyed by PRODUCT_COLUMNS, or an empty list.
+    """
+    query = build_search_query(text)
+    if query is None:
+        return []
+
+    conditions = ['products_fts MATCH ?']
+    params = [query]
+    if source is not None:
+        conditions.append('p.source = ?')
+        params.append(source)
+
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT {", ".join("p." + column for column in PRODUCT_COLUMNS)}
+        FROM products_fts JOIN products p ON p.id = products_fts.rowid
+        WHERE {" AND ".join(conditions)}
+        ORDER BY bm25(products_fts), p.id
+        LIMIT ? OFFSET ?
+    ''', params + [limit, offset])
+    return [dict(zip(PRODUCT_COLUMNS, row)) for row in cursor.fetchall()]
 
 def get_product_by_name_and_source(conn, name, source):
     """Get a product by name and source."""
@@ -41,9 +265,12 @@ def update_product(conn, product_id, updated_product):
         cursor = conn.cursor()
         cursor.execute('''
             UPDATE products
-            SET image = ?, name = ?, price = ?, source = ?
+            SET image = ?, name = ?, price = ?, source = ?, price_cents = ?, last_seen = CURRENT_TIMESTAMP,
+                version = (SELECT value FROM meta WHERE key = 'data_generation') + 1
             WHERE id = ?
-        ''', (updated_product['image'], updated_product['name'], updated_product['price'], updated_product['source'], product_id))
+        ''', (updated_product['image'], updated_product['name'], updated_product['price'], updated_product['source'],
+              parse_price(updated_product['price']), product_id))
+        bump_data_generation(conn)
         conn.commit()
         
     except sqlite3.Error as e:
@@ -54,30 +281,660 @@ def insert_product(conn, product):
     try:
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO products (image, name, price, source)
-            VALUES (?, ?, ?, ?)
-        ''', (product['image'], product['name'], product['price'], product['source']))
+            INSERT INTO products (image, name, price, source, price_cents, pack_size, pack_unit, last_seen, version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, (SELECT value FROM meta WHERE key = 'data_generation') + 1)
+        ''', (product['image'], product['name'], product['price'], product['source'], parse_price(product['price']))
+              + parse_pack_size(product['name']))
+        bump_data_generation(conn)
         conn.commit()
     except sqlite3.Error as e:
         print(f"Error: {e}")
+def ensure_unique_key(conn):
+    """Migration 1: make (name, source) unique so bulk upserts can rely on ON CONFLICT.
+
+    Older databases may hold duplicate rows from before the key existed; only the
+    most recently inserted copy of each product is kept.
+    """
+    conn.execute('''
+        DELETE FROM products
+        WHERE id NOT IN (SELECT MAX(id) FROM products GROUP BY name, source)
+    ''')
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_products_name_source
+        ON products (name, source)
+    ''')
+
+def add_typed_prices(conn):
+    """Migration 2: add parsed price and pack size columns, last_seen and the price_history table.
+
+    The text price column stays as it is for existing clients.
+    """
+    conn.execute('ALTER TABLE products ADD COLUMN price_cents INTEGER')
+    conn.execute('ALTER TABLE products ADD COLUMN pack_size REAL')
+    conn.execute('ALTER TABLE products ADD COLUMN pack_unit TEXT')
+    conn.execute('ALTER TABLE products ADD COLUMN last_seen TEXT')
+
+    # Fill the new columns in for rows scraped before they existed
+    rows = conn.execute('SELECT id, name, price FROM products').fetchall()
+    conn.executemany('''
+        UPDATE products SET price_cents = ?, pack_size = ?, pack_unit = ?, last_seen = CURRENT_TIMESTAMP WHERE id = ?
+    ''', [(parse_price(price),) + parse_pack_size(name) + (product_id,) for product_id, name, price in rows])
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_products_source_name ON products (source, name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_products_price_cents ON products (price_cents)')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            price TEXT,
+            price_cents INTEGER,
+            recorded_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_price_history_product ON price_history (product_id, recorded_at)')
+
+    # History gets a row when a product first appears and whenever its price text changes,
+    # inside the same transaction as the batch that wrote it
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_price_history_insert
+        AFTER INSERT ON products WHEN new.price IS NOT NULL
+        BEGIN
+            INSERT INTO price_history (product_id, price, price_cents) VALUES (new.id, new.price, new.price_cents);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_price_history_update
+        AFTER UPDATE OF price ON products WHEN old.price IS NOT new.price
+        BEGIN
+            INSERT INTO price_history (product_id, price, price_cents) VALUES (new.id, new.price, new.price_cents);
+        END
+    ''')
+    conn.execute('''
+        INSERT INTO price_history (product_id, price, price_cents)
+        SELECT id, price, price_cents FROM products WHERE price IS NOT NULL
+    ''')
+
+def add_listing_indexes(conn):
+    """Migration 3: indexes backing the filtered, keyset-paginated product listing.
+
+    SQLite appends the rowid (id) to every index, so each one also serves the id tie-breaker.
+    """
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_products_source ON products (source)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_products_source_price ON products (source, price_cents)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_products_name ON products (name)')
+
+def add_data_generation(conn):
+    """Migration 4: a meta table holding the data generation, a counter bumped by every write
+    that changes product data, so readers can tell cheaply whether anything changed.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_generation', 0)")
+
+def add_product_search(conn):
+    """Migration 5: an FTS5 index over product names, kept in step with products by triggers.
+
+    It is an external-content table, so names are not stored twice; prefix indexes for 2 and 3
+    characters keep short prefix queries such as "cia*" fast.
+    """
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name,
+            content = 'products',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products
+        BEGIN
+            INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+        END
+    ''')
+    conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+def add_product_matching(conn):
+    """Migration 6: tables linking the same item across retailers, filled in by matching.py.
+
+    match_groups holds one row per distinct item, with the normalised name tokens and pack size
+    it was matched on; product_matches puts each product in exactly one group.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS match_groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            tokens TEXT NOT NULL,
+            pack_amount REAL,
+            pack_unit TEXT,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS product_matches (
+            product_id INTEGER PRIMARY KEY,
+            group_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            matched_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_product_matches_group ON product_matches (group_id)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_match_delete AFTER DELETE ON products
+        BEGIN
+            DELETE FROM product_matches WHERE product_id = old.id;
+        END
+    ''')
+
+def add_change_tracking(conn):
+    """Migration 7: a version on every product row and tombstones for deleted ones, for the change feed.
+
+    A row's version is the data generation its last real change was written in. Existing rows
+    get a generation of their own so a client syncing from version 0 receives all of them.
+    """
+    conn.execute('ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    bump_data_generation(conn)
+    conn.execute("UPDATE products SET version = (SELECT value FROM meta WHERE key = 'data_generation')")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_products_version ON products (version)')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS product_tombstones (
+            product_id INTEGER PRIMARY KEY,
+            name TEXT,
+            source TEXT,
+            version INTEGER NOT NULL,
+            deleted_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_product_tombstones_version ON product_tombstones (version)')
+    # Deletes are versioned like writes: with the generation the deleting transaction bumps to
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_tombstone_delete AFTER DELETE ON products
+        BEGIN
+            INSERT OR REPLACE INTO product_tombstones (product_id, name, source, version)
+            VALUES (old.id, old.name, old.source, (SELECT value FROM meta WHERE key = 'data_generation') + 1);
+        END
+    ''')
+
+def add_summary_tables(conn):
+    """Migration 8: summary tables behind /stats, refreshed by stats.py at the end of each scrape.
+
+    source_stats has one row of aggregates per source, cheapest_products the cheapest few
+    products per source (and '*' for all of them), and price_drops every product whose latest
+    price change was a drop. stats_version in meta is the data generation they were refreshed at.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS source_stats (
+            source TEXT PRIMARY KEY,
+            product_count INTEGER NOT NULL,
+            priced_count INTEGER NOT NULL,
+            min_price_cents INTEGER,
+            max_price_cents INTEGER,
+            avg_price_cents REAL,
+            refreshed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cheapest_products (
+            source TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            name TEXT,
+            price TEXT,
+            price_cents INTEGER,
+            product_source TEXT,
+            PRIMARY KEY (source, rank)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_drops (
+            product_id INTEGER PRIMARY KEY,
+            name TEXT,
+            source TEXT,
+            old_price_cents INTEGER NOT NULL,
+            new_price_cents INTEGER NOT NULL,
+            drop_cents INTEGER NOT NULL,
+            drop_percent REAL NOT NULL,
+            changed_at TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_price_drops_drop ON price_drops (drop_cents DESC)')
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('stats_version', 0)")
+
+def add_scrape_runs(conn):
+    """Migration 9: scrape_runs, one summary row per ConnectorScript run.
+
+    metrics holds the run's histograms and counters (per-page and per-stage durations, rate
+    limit waits, retries, skipped products, DB write latency) as a metrics.py snapshot in JSON.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            finished_at TEXT NOT NULL,
+            duration_seconds REAL NOT NULL,
+            mode TEXT NOT NULL,
+            pages INTEGER NOT NULL,
+            failed_pages INTEGER NOT NULL,
+            products INTEGER NOT NULL,
+            inserted INTEGER NOT NULL,
+            updated INTEGER NOT NULL,
+            unchanged INTEGER NOT NULL,
+            skipped INTEGER NOT NULL,
+            metrics TEXT NOT NULL DEFAULT '{}'
+        )
+    ''')
+
+def add_page_stats(conn):
+    """Migration 10: page_stats, how often each retailer listing page changes, for the refresh scheduler.
+
+    visits, changes and observed_hours are decayed tallies of the revisits, how many of them found
+    changed products and the hours between them; change_rate is the changes per hour estimated from
+    them. Times are Unix timestamps.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS page_stats (
+            retailer TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            visits REAL NOT NULL DEFAULT 0,
+            changes REAL NOT NULL DEFAULT 0,
+            observed_hours REAL NOT NULL DEFAULT 0,
+            change_rate REAL,
+            last_visited_at REAL,
+            last_changed_at REAL,
+            PRIMARY KEY (retailer, page)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_page_stats_visited ON page_stats (last_visited_at)')
+
+def add_page_fingerprints(conn):
+    """Migration 11: page_fingerprints, a hash of the products each listing page had when it was
+    last stored, so an unchanged page can skip the database; and scrape_runs.skipped_pages.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS page_fingerprints (
+            retailer TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            fingerprint TEXT NOT NULL,
+            product_count INTEGER NOT NULL,
+            stored_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (retailer, page)
+        )
+    ''')
+    conn.execute('ALTER TABLE scrape_runs ADD COLUMN skipped_pages INTEGER NOT NULL DEFAULT 0')
+
+def add_catalogue_sizes(conn):
+    """Migration 12: catalogue_sizes, how many listing pages each retailer had when a crawl last reached
+    the end, so the refresh scheduler doesn't keep visiting pages past it.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalogue_sizes (
+            retailer TEXT PRIMARY KEY,
+            page_count INTEGER NOT NULL,
+            updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+# Schema migrations in order; PRAGMA user_version records how many have been applied
+MIGRATIONS = [
+    ensure_unique_key,
+    add_typed_prices,
+    add_listing_indexes,
+    add_data_generation,
+    add_product_search,
+    add_product_matching,
+    add_change_tracking,
+    add_summary_tables,
+    add_scrape_runs,
+    add_page_stats,
+    add_page_fingerprints,
+    add_catalogue_sizes,
+]
+
+def migrate_schema(conn):
+    """Apply any schema migrations the database hasn't had yet, each in its own transaction."""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if version >= number:
+            continue
+        try:
+            with conn:
+                conn.execute('BEGIN')  # DDL doesn't open a transaction by itself
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {number}')
+        except sqlite3.Error as e:
+            print(f"Error: migration {number} ({migration.__name__}) failed: {e}")
+            return
+
+def schema_is_current(conn):
+    """Whether the database has had every schema migration, so the current queries can run against it."""
+    return conn.execute('PRAGMA user_version').fetchone()[0] >= len(MIGRATIONS)
+
+def get_data_generation(conn):
+    """Get the current data generation, or 0 for a database that predates it."""
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'data_generation'").fetchone()
+    except sqlite3.Error:
+        return 0
+    return row[0] if row else 0
+
+def bump_data_generation(conn):
+    """Advance the data generation; call inside the transaction that changed the products."""
+    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'data_generation'")
+
+def begin_write(conn):
+    """
+    Start the write transaction now rather than at its first write, so nothing it reads before
+    then can be changed by another writer before it commits. Call it first thing inside `with conn:`.
+    """
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+
+def upsert_products(conn, products):
+    """Insert or update a batch of products in a single transaction.
+
+    Rows are keyed on (name, source) and an existing row's data is only written when its
+    price or image has actually changed; otherwise just its last_seen time is bumped.
+    Price changes are logged to price_history by triggers in the same transaction, which
+    also bumps the data generation if anything was inserted or updated; the rows written
+    get the new generation as their version.
+    Products without a name can't be keyed and are skipped.
+
+    Returns:
+        dict: Counts of 'inserted', 'updated', 'unchanged' and 'skipped' products.
+    """
+    rows = []
+    skipped = 0
+    for product in products:
+        if not product.get('name'):
+            skipped += 1
+            continue
+        price = product.get('price')
+        rows.append((product.get('image'), product['name'], price, product.get('source'), parse_price(price))
+                    + parse_pack_size(product['name']))
+
+    result = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': skipped}
+    if not rows:
+        return result
+
+    try:
+        with conn:  # Commits once at the end, or rolls the whole batch back
+            # The generation and the stored keys are read under the write lock, so two writers
+            # can't stamp their rows with the same version or count the same insert
+            begin_write(conn)
+            cursor = conn.cursor()
+            # Count the inserts up front from the keys that aren't stored yet, one index lookup each.
+            # A NULL source never conflicts, so those rows are always inserted.
+            new_keys = set()
+            inserted = 0
+            for row in rows:
+                key = (row[1], row[3])
+                if key[1] is None:
+                    inserted += 1
+                elif key not in new_keys and cursor.execute(
+                        'SELECT 1 FROM products WHERE name = ? AND source = ?', key).fetchone() is None:
+                    new_keys.add(key)
+                    inserted += 1
+            version = get_data_generation(conn) + 1
+
+            # rowcount is summed over the batch: 1 for every insert or real update,
+            # 0 when the WHERE clause finds nothing to change.
+            cursor.executemany('''
+                INSERT INTO products (image, name, price, source, price_cents, pack_size, pack_unit, last_seen, version)
+                VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+                ON CONFLICT (name, source) DO UPDATE
+                SET image = excluded.image, price = excluded.price, price_cents = excluded.price_cents,
+                    version = excluded.version
+                WHERE products.price IS NOT excluded.price OR products.image IS NOT excluded.image
+            ''', [row + (version,) for row in rows])
+            changed = cursor.rowcount
+            if changed:
+                bump_data_generation(conn)
+
+            # Everything in the batch was seen just now, changed or not
+            cursor.executemany('''
+                UPDATE products SET last_seen = CURRENT_TIMESTAMP WHERE name = ? AND source = ?
+            ''', [(row[1], row[3]) for row in rows])
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+        return result
+
+    result['inserted'] = inserted
+    result['updated'] = changed - inserted
+    result['unchanged'] = len(rows) - changed
+    return result
+
+def delete_products(conn, product_ids):
+    """Delete products by id in one transaction, leaving tombstones for the change feed.
+
+    Returns:
+        int: The number of products deleted.
+    """
+    try:
+        with conn:
+            cursor = conn.executemany('DELETE FROM products WHERE id = ?', [(product_id,) for product_id in product_ids])
+            if cursor.rowcount:
+                bump_data_generation(conn)
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+        return 0
+
+def list_changes(conn, after=(0, 0), limit=500):
+    """
+    Get products written or deleted after a point in the change feed, oldest change first.
+
+    Args:
+        after (tuple): (version, id) of the last change the client has seen.
+        limit (int): Maximum number of changes to return.
+
+    Returns:
+        list of dict: {'op': 'upsert', 'version', 'product': {...}} for products that are new or
+        changed, keyed by PRODUCT_COLUMNS, and {'op': 'delete', 'version', 'product': {'id', 'name',
+        'source'}} for deleted ones. A product appears once, at its latest version.
+    """
+    cursor = conn.cursor()
+    # Each half seeks its version index and stops after limit rows, so the final sort stays small
+    cursor.execute(f'''
+        SELECT * FROM (
+            SELECT * FROM (
+                SELECT 'upsert', version, {", ".join(PRODUCT_COLUMNS)}
+                FROM products WHERE (version, id) > (?, ?) ORDER BY version, id LIMIT ?
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT 'delete', version, product_id, NULL, name, NULL, source, NULL
+                FROM product_tombstones WHERE (version, product_id) > (?, ?) ORDER BY version, product_id LIMIT ?
+            )
+        )
+        ORDER BY 2, 3 LIMIT ?
+    ''', (after[0], after[1], limit, after[0], after[1], limit, limit))
+
+    changes = []
+    for op, version, *values in cursor.fetchall():
+        product = dict(zip(PRODUCT_COLUMNS, values))
+        if op == 'delete':
+            product = {'id': product['id'], 'name': product['name'], 'source': product['source']}
+        changes.append({'op': op, 'version': version, 'product': product})
+    return changes
+
 def update_or_insert_product(conn, product):
     """Update the product if it exists and the price or image has changed, or insert it if it doesn't exist."""
-    existing_product = get_product_by_name_and_source(conn, product['name'], product['source'])
-    
-    if existing_product:
-        product_id, existing_price = existing_product
-        # Fetch the current image for this product
+    return upsert_products(conn, [product])
+
+
+def create_crawl_state_table(conn):
+    """Create the crawl_state table, which holds one resumable checkpoint per retailer."""
+    try:
         cursor = conn.cursor()
-        cursor.execute('SELECT image FROM products WHERE id = ?', (product_id,))
-        existing_image = cursor.fetchone()[0]
-        
-        # Update the product if the price or image has changed
-        if existing_price != product['price'] or existing_image != product['image']:
-            update_product(conn, product_id, product)
-    else:
-        # Insert new product if it doesn't exist
-        insert_product(conn, product)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_state (
+                retailer TEXT PRIMARY KEY,
+                run_id TEXT NOT NULL,
+                last_completed_page INTEGER NOT NULL DEFAULT -1,
+                failed_pages TEXT NOT NULL DEFAULT '[]',
+                status TEXT NOT NULL,
+                updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
+def get_crawl_state(conn, retailer):
+    """
+    Get the saved crawl checkpoint for a retailer.
+
+    Returns:
+        dict: With run_id, last_completed_page, failed_pages (a list of page numbers) and status,
+        or None if the retailer has never been crawled.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT run_id, last_completed_page, failed_pages, status FROM crawl_state WHERE retailer = ?
+    ''', (retailer,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return {
+        'run_id': row[0],
+        'last_completed_page': row[1],
+        'failed_pages': json.loads(row[2]),
+        'status': row[3]
+    }
+
+def save_crawl_state(conn, retailer, run_id, last_completed_page, failed_pages, status):
+    """Save a retailer's crawl checkpoint, replacing the previous one."""
+    try:
+        with conn:
+            conn.execute('''
+                INSERT INTO crawl_state (retailer, run_id, last_completed_page, failed_pages, status, updated_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (retailer) DO UPDATE
+                SET run_id = excluded.run_id, last_completed_page = excluded.last_completed_page,
+                    failed_pages = excluded.failed_pages, status = excluded.status, updated_at = excluded.updated_at
+            ''', (retailer, run_id, last_completed_page, json.dumps(sorted(failed_pages)), status))
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+
+# Columns of a scrape_runs row, in table order
+SCRAPE_RUN_COLUMNS = ['id', 'started_at', 'finished_at', 'duration_seconds', 'mode', 'pages', 'failed_pages',
+                      'products', 'inserted', 'updated', 'unchanged', 'skipped', 'metrics', 'skipped_pages']
+
+def save_scrape_run(conn, run):
+    """
+    Save the summary of a finished scrape run.
+
+    Args:
+        run (dict): A value for every column in SCRAPE_RUN_COLUMNS except id; metrics is a dict.
+
+    Returns:
+        int: The new run's id, or None if it couldn't be saved.
+    """
+    columns = SCRAPE_RUN_COLUMNS[1:]
+    values = [json.dumps(run['metrics']) if column == 'metrics' else run[column] for column in columns]
+    try:
+        with conn:
+            cursor = conn.execute(f'''
+                INSERT INTO scrape_runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+            ''', values)
+        return cursor.lastrowid
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+        return None
+
+def get_latest_scrape_run(conn):
+    """Get the most recent scrape run's summary as a dict, with metrics parsed, or None if there hasn't been one."""
+    row = conn.execute(f'''
+        SELECT {', '.join(SCRAPE_RUN_COLUMNS)} FROM scrape_runs ORDER BY id DESC LIMIT 1
+    ''').fetchone()
+    if row is None:
+        return None
+    run = dict(zip(SCRAPE_RUN_COLUMNS, row))
+    run['metrics'] = json.loads(run['metrics'])
+    return run
+
+# Columns of a page_stats row, in table order
+PAGE_STATS_COLUMNS = ['retailer', 'page', 'visits', 'changes', 'observed_hours', 'change_rate',
+                      'last_visited_at', 'last_changed_at']
+
+def get_page_stats(conn, retailer):
+    """Get the page_stats rows of a retailer as a dict of dicts keyed by page number."""
+    rows = conn.execute(f'''
+        SELECT {', '.join(PAGE_STATS_COLUMNS)} FROM page_stats WHERE retailer = ?
+    ''', (retailer,)).fetchall()
+    return {row[1]: dict(zip(PAGE_STATS_COLUMNS, row)) for row in rows}
+
+def save_page_stats(conn, stats):
+    """Save one page's stats (a dict with every column in PAGE_STATS_COLUMNS), replacing the old row."""
+    try:
+        with conn:
+            conn.execute(f'''
+                INSERT OR REPLACE INTO page_stats ({', '.join(PAGE_STATS_COLUMNS)})
+                VALUES ({', '.join('?' * len(PAGE_STATS_COLUMNS))})
+            ''', [stats[column] for column in PAGE_STATS_COLUMNS])
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+
+def get_catalogue_size(conn, retailer):
+    """Get the number of listing pages a retailer had when a crawl last reached the end, or None."""
+    row = conn.execute('SELECT page_count FROM catalogue_sizes WHERE retailer = ?', (retailer,)).fetchone()
+    return row[0] if row else None
+
+def save_catalogue_size(conn, retailer, page_count):
+    """Save the number of listing pages a crawl found a retailer's catalogue to have."""
+    try:
+        with conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO catalogue_sizes (retailer, page_count, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', (retailer, page_count))
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+
+def count_recent_page_visits(conn, since):
+    """Count the pages last visited at or after the given Unix time."""
+    return conn.execute('SELECT COUNT(*) FROM page_stats WHERE last_visited_at >= ?', (since,)).fetchone()[0]
+
+def fingerprint_products(products):
+    """Hash of a page's products, in page order: the same products at the same prices give the same hash."""
+    content = [[product.get(key) for key in ('name', 'price', 'image', 'source')] for product in products]
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def get_page_fingerprint(conn, retailer, page):
+    """Get the fingerprint of the products last stored from a page, or None."""
+    row = conn.execute('SELECT fingerprint FROM page_fingerprints WHERE retailer = ? AND page = ?',
+                       (retailer, page)).fetchone()
+    return row[0] if row else None
+
+def save_page_fingerprint(conn, retailer, page, fingerprint, product_count):
+    """Save the fingerprint of the products just stored from a page."""
+    try:
+        with conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO page_fingerprints (retailer, page, fingerprint, product_count, stored_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (retailer, page, fingerprint, product_count))
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
 def close_connection(conn):
     """Close the database connection."""
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+
+# Rows read from SQLite per fetchmany call, which is also how many rows go into each output chunk
+EXPORT_CHUNK_SIZE = 500
+
+# Columns written by the exports, in order
+EXPORT_COLUMNS = ['id', 'image', 'name', 'price', 'source', 'price_cents', 'pack_size', 'pack_unit', 'last_seen']
+
+def iter_row_chunks(conn, query, params=(), chunk_size=EXPORT_CHUNK_SIZE):
+    """Runs a query and yields its rows in lists of at most chunk_size, so only one chunk is ever in memory."""
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+def stream_json(chunks, columns):
+    """Writes rows as one JSON array of objects, a chunk of rows at a time."""
+    yield '['
+    first = True
+    for rows in chunks:
+        items = ','.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) for row in rows)
+        yield items if first else ',' + items
+        first = False
+    yield ']'
+
+def stream_ndjson(chunks, columns):
+    """Writes rows as newline-delimited JSON, one object per line."""
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+
+def stream_csv(chunks, columns):
+    """Writes rows as CSV with a header line."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+# Supported export formats: the writer and the content type to send it with
+EXPORT_FORMATS = {
+    'json': (stream_json, 'application/json'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+    'csv': (stream_csv, 'text/csv'),
+}
+
+def export_products(conn, fmt='json', columns=EXPORT_COLUMNS, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Streams the whole products table in the given format.
+
+    Yields:
+        str: Pieces of the output, each covering up to chunk_size rows, so memory use stays
+        the same however large the table is.
+    """
+    writer = EXPORT_FORMATS[fmt][0]
+    query = f'SELECT {", ".join(columns)} FROM products ORDER BY id'
+    return writer(iter_row_chunks(conn, query, chunk_size=chunk_size), columns)
@@ -0,0 +1,201 @@
+import math
+import re
+import sqlite3
+import unicodedata
+from collections import defaultdict
+from database import PACK_SIZE_PATTERN, PRODUCT_COLUMNS, build_search_query, bump_data_generation, parse_pack_size
+
+# Retailer house brands, removed so the same item sold under each retailer's name can still match
+HOUSE_BRANDS = ['woolworths', 'pick n pay', 'pnp', 'checkers', 'no name', 'simple truth', 'housebrand', 'ritebrand']
+HOUSE_BRAND_PATTERN = re.compile(r'\b(?:' + '|'.join(re.escape(brand) for brand in HOUSE_BRANDS) + r')\b')
+
+# Words that say nothing about which item it is
+STOP_TOKENS = {'and', 'the', 'of', 'with', 'for', 'x', 'per', 'each', 'ea', 'pack', 'pk'}
+
+# Pack units converted to a base unit, so "300 g" and "0.3kg" compare equal
+PACK_UNITS = {
+    'g': ('g', 1), 'kg': ('g', 1000),
+    'ml': ('ml', 1), 'l': ('ml', 1000),
+    'pk': ('ea', 1), 's': ('ea', 1),
+}
+
+# Lowest token similarity (Jaccard) at which two names are taken to be the same item
+MATCH_THRESHOLD = 0.6
+
+def normalize_pack(size, unit):
+    """Convert a parsed pack size to (amount, base unit), e.g. (0.3, 'kg') -> (300.0, 'g')."""
+    if size is None:
+        return None, None
+    base_unit, factor = PACK_UNITS[unit]
+    return round(size * factor, 3), base_unit
+
+def normalize_name(name):
+    """
+    Reduce a product name to what identifies the item across retailers.
+
+    Returns:
+        tuple: (tokens, pack amount, pack unit), where tokens is a frozenset of lower-case words
+        without punctuation, accents, house brands, stop words or the pack size.
+    """
+    amount, unit = normalize_pack(*parse_pack_size(name))
+    text = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii').lower()
+    text = PACK_SIZE_PATTERN.sub(' ', text)
+    text = HOUSE_BRAND_PATTERN.sub(' ', text)
+    tokens = frozenset(token for token in re.findall(r'[a-z0-9]+', text) if token not in STOP_TOKENS)
+    return tokens, amount, unit
+
+def similarity(tokens, other):
+    """Jaccard similarity of two token sets."""
+    if not tokens or not other:
+        return 0.0
+    return len(tokens & other) / len(tokens | other)
+
+class GroupIndex:
+    """
+    The existing match groups, blocked by pack size and token so a product is only scored
+    against groups that could reach MATCH_THRESHOLD, instead of against every group.
+    """
+
+    def __init__(self):
+        self.groups = {}                 # group id -> tokens
+        self.sources = defaultdict(set)  # group id -> sources already in the group
+        self.postings = defaultdict(set) # (pack amount, pack unit, token) -> group ids
+
+    def add(self, group_id, tokens, amount, unit):
+        self.groups[group_id] = tokens
+        for token in tokens:
+            self.postings[(amount, unit, token)].add(group_id)
+
+    def best_match(self, tokens, amount, unit, source):
+        """Returns (group id, score) of the most similar compatible group, or (None, 0.0).
+
+        Different pack sizes are different items, so only groups with the same pack are looked at.
+        A group reaching the threshold must share all but len(tokens) - ceil(threshold * len(tokens))
+        of the product's tokens, so it is enough to look up that many plus one, the rarest first.
+        """
+        blocks = sorted((self.postings.get((amount, unit, token), set()) for token in tokens), key=len)
+        probe = len(blocks) - math.ceil(MATCH_THRESHOLD * len(blocks)) + 1
+        candidates = set().union(*blocks[:probe])
+
+        best_id, best_score = None, 0.0
+        for group_id in candidates:
+            group_tokens = self.groups[group_id]
+            # One retailer never sells the same item twice
+            if source in self.sources[group_id]:
+                continue
+            score = similarity(tokens, group_tokens)
+            if score > best_score or (score == best_score and best_id is not None and group_id < best_id):
+                best_id, best_score = group_id, score
+        if best_score < MATCH_THRESHOLD:
+            return None, 0.0
+        return best_id, best_score
+
+def load_group_index(conn):
+    """Read every match group and the sources already in it."""
+    index = GroupIndex()
+    for group_id, tokens, amount, unit in conn.execute('SELECT id, tokens, pack_amount, pack_unit FROM match_groups'):
+        index.add(group_id, frozenset(tokens.split()), amount, unit)
+    for group_id, source in conn.execute('''
+        SELECT DISTINCT m.group_id, p.source FROM product_matches m JOIN products p ON p.id = m.product_id
+    '''):
+        index.sources[group_id].add(source)
+    return index
+
+def match_new_products(conn):
+    """
+    Put every product that isn't in a match group yet into one, in a single transaction.
+
+    Names never change for a product (they are part of its key), so only products scraped
+    for the first time need matching; earlier matches are left alone. Each one joins the most
+    similar group with the same pack size and no product from its retailer, or starts a new group.
+
+    Returns:
+        dict: Counts of products 'matched' to an existing group and new 'groups' created.
+    """
+    result = {'matched': 0, 'groups': 0}
+    try:
+        with conn:
+            unmatched = conn.execute('''
+                SELECT p.id, p.name, p.source FROM products p
+                LEFT JOIN product_matches m ON m.product_id = p.id
+                WHERE m.product_id IS NULL
+                ORDER BY p.id
+            ''').fetchall()
+            if not unmatched:
+                return result
+
+            index = load_group_index(conn)
+            matches = []
+            for product_id, name, source in unmatched:
+                tokens, amount, unit = normalize_name(name)
+                group_id, score = index.best_match(tokens, amount, unit, source)
+                if group_id is None:
+                    group_id = conn.execute('''
+                        INSERT INTO match_groups (name, tokens, pack_amount, pack_unit) VALUES (?, ?, ?, ?)
+                    ''', (name, ' '.join(sorted(tokens)), amount, unit)).lastrowid
+                    index.add(group_id, tokens, amount, unit)
+                    score = 1.0
+                    result['groups'] += 1
+                else:
+                    result['matched'] += 1
+                index.sources[group_id].add(source)
+                matches.append((product_id, group_id, score))
+
+            conn.executemany('INSERT INTO product_matches (product_id, group_id, score) VALUES (?, ?, ?)', matches)
+            # /compare answers change with the groups, so cached API responses must go
+            bump_data_generation(conn)
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+    return result
+
+def get_group_offers(conn, group_ids):
+    """
+    Get every offer in the given match groups, cheapest first.
+
+    Returns:
+        dict: Group id -> {'id', 'name', 'offers': [...], 'cheapest': offer or None}, in the order
+        of group_ids, leaving out groups that don't exist. Offers are keyed by PRODUCT_COLUMNS.
+    """
+    if not group_ids:
+        return {}
+    placeholders = ', '.join('?' for _ in group_ids)
+    groups = {}
+    for group_id, name in conn.execute(f'SELECT id, name FROM match_groups WHERE id IN ({placeholders})', group_ids):
+        groups[group_id] = {'id': group_id, 'name': name, 'offers': [], 'cheapest': None}
+
+    # Products without a parsed price go last
+    for row in conn.execute(f'''
+        SELECT m.group_id, {", ".join("p." + column for column in PRODUCT_COLUMNS)}
+        FROM product_matches m JOIN products p ON p.id = m.product_id
+        WHERE m.group_id IN ({placeholders})
+        ORDER BY m.group_id, p.price_cents IS NULL, p.price_cents, p.id
+    ''', group_ids):
+        groups[row[0]]['offers'].append(dict(zip(PRODUCT_COLUMNS, row[1:])))
+
+    for group in groups.values():
+        if group['offers'] and group['offers'][0]['price_cents'] is not None:
+            group['cheapest'] = group['offers'][0]
+    return {group_id: groups[group_id] for group_id in group_ids if group_id in groups}
+
+def compare_products(conn, text, limit=20):
+    """
+    Find the match groups whose products' names best fit a search, with their offers.
+
+    Returns:
+        list of dict: Up to limit groups as returned by get_group_offers, best match first.
+    """
+    query = build_search_query(text)
+    if query is None:
+        return []
+    # bm25() can't be used inside an aggregate, so the matching products are ranked first
+    rows = conn.execute('''
+        WITH hits AS MATERIALIZED (
+            SELECT rowid AS product_id, bm25(products_fts) AS score FROM products_fts WHERE products_fts MATCH ?
+        )
+        SELECT m.group_id FROM hits
+        JOIN product_matches m ON m.product_id = hits.product_id
+        GROUP BY m.group_id
+        ORDER BY MIN(hits.score), m.group_id
+        LIMIT ?
+    ''', (query, limit)).fetchall()
+    return list(get_group_offers(conn, [row[0] for row in rows]).values())
@@ -0,0 +1,143 @@
+import sqlite3
+from database import begin_write, bump_data_generation, get_data_generation
+
+# Products kept per source in cheapest_products, and the most a /stats request can ask for
+CHEAPEST_PER_SOURCE = 50
+
+# Key of the all-sources rows in cheapest_products
+ALL_SOURCES = '*'
+
+def changed_sources(conn, since_version):
+    """The sources with a product inserted, updated or deleted after since_version."""
+    rows = conn.execute('''
+        SELECT source FROM products WHERE version > ?
+        UNION
+        SELECT source FROM product_tombstones WHERE version > ?
+    ''', (since_version, since_version)).fetchall()
+    return [row[0] for row in rows]
+
+def refresh_source(conn, source):
+    """Recompute one source's aggregates and cheapest products, each from one index range."""
+    count, priced, min_cents, max_cents, avg_cents = conn.execute('''
+        SELECT COUNT(*), COUNT(price_cents), MIN(price_cents), MAX(price_cents), AVG(price_cents)
+        FROM products WHERE source IS ?
+    ''', (source,)).fetchone()
+    conn.execute('DELETE FROM cheapest_products WHERE source IS ?', (source,))
+    if count == 0:
+        conn.execute('DELETE FROM source_stats WHERE source IS ?', (source,))
+        return
+
+    conn.execute('''
+        INSERT OR REPLACE INTO source_stats
+            (source, product_count, priced_count, min_price_cents, max_price_cents, avg_price_cents, refreshed_at)
+        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (source, count, priced, min_cents, max_cents, avg_cents))
+    conn.execute('''
+        INSERT INTO cheapest_products (source, rank, product_id, name, price, price_cents, product_source)
+        SELECT source, ROW_NUMBER() OVER (ORDER BY price_cents, id), id, name, price, price_cents, source
+        FROM (
+            SELECT * FROM products WHERE source IS ? AND price_cents IS NOT NULL ORDER BY price_cents, id LIMIT ?
+        )
+    ''', (source, CHEAPEST_PER_SOURCE))
+
+def refresh_overall_cheapest(conn):
+    """The cheapest products overall are among the cheapest of each source, so only those are sorted."""
+    conn.execute('DELETE FROM cheapest_products WHERE source = ?', (ALL_SOURCES,))
+    conn.execute('''
+        INSERT INTO cheapest_products (source, rank, product_id, name, price, price_cents, product_source)
+        SELECT ?, ROW_NUMBER() OVER (ORDER BY price_cents, product_id), product_id, name, price, price_cents, product_source
+        FROM (
+            SELECT * FROM cheapest_products WHERE source IS NOT ? ORDER BY price_cents, product_id LIMIT ?
+        )
+    ''', (ALL_SOURCES, ALL_SOURCES, CHEAPEST_PER_SOURCE))
+
+def refresh_price_drops(conn, since_version):
+    """Recompute the latest price change of every product written or deleted after since_version."""
+    conn.execute('''
+        DELETE FROM price_drops WHERE product_id IN (
+            SELECT id FROM products WHERE version > ?
+            UNION
+            SELECT product_id FROM product_tombstones WHERE version > ?
+        )
+    ''', (since_version, since_version))
+    # The two most recent prices of each changed product, from its price_history
+    conn.execute('''
+        WITH ranked AS (
+            SELECT product_id, price_cents, recorded_at,
+                   ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY id DESC) AS position
+            FROM price_history
+            WHERE product_id IN (SELECT id FROM products WHERE version > ?)
+        )
+        INSERT INTO price_drops
+            (product_id, name, source, old_price_cents, new_price_cents, drop_cents, drop_percent, changed_at)
+        SELECT p.id, p.name, p.source, previous.price_cents, latest.price_cents,
+               previous.price_cents - latest.price_cents,
+               100.0 * (previous.price_cents - latest.price_cents) / previous.price_cents,
+               latest.recorded_at
+        FROM ranked latest
+        JOIN ranked previous ON previous.product_id = latest.product_id AND previous.position = 2
+        JOIN products p ON p.id = latest.product_id
+        WHERE latest.position = 1 AND previous.price_cents > latest.price_cents
+    ''', (since_version,))
+
+def refresh_summary_tables(conn):
+    """
+    Bring the /stats summary tables up to date with the products, in one transaction.
+
+    Only sources and products written or deleted since the last refresh are recomputed, each
+    with an indexed lookup, so a run that changed little refreshes quickly however big the
+    catalogue is.
+
+    Returns:
+        list: The sources that were refreshed.
+    """
+    try:
+        with conn:
+            # stats_version is read under the write lock, so no write can land between it and the refresh
+            begin_write(conn)
+            since_version = conn.execute("SELECT value FROM meta WHERE key = 'stats_version'").fetchone()[0]
+            sources = changed_sources(conn, since_version)
+            if not sources:
+                return []
+
+            for source in sources:
+                refresh_source(conn, source)
+            refresh_overall_cheapest(conn)
+            refresh_price_drops(conn, since_version)
+
+            # Cached /stats responses were built from the old summaries
+            bump_data_generation(conn)
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'stats_version'", (get_data_generation(conn),))
+            return sources
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+        return []
+
+def get_stats(conn, limit=10, source=None):
+    """
+    Read the summary tables.
+
+    Returns:
+        dict: 'sources' (aggregates per source, prices in cents), 'cheapest' (up to limit
+        products, for one source or all of them) and 'price_drops' (the limit biggest latest
+        price drops, optionally for one source).
+    """
+    sources = [
+        dict(zip(['source', 'product_count', 'priced_count', 'min_price_cents', 'max_price_cents', 'avg_price_cents', 'refreshed_at'], row))
+        for row in conn.execute('SELECT * FROM source_stats ORDER BY source')
+    ]
+    cheapest = [
+        dict(zip(['id', 'name', 'price', 'price_cents', 'source'], row))
+        for row in conn.execute('''
+            SELECT product_id, name, price, price_cents, product_source FROM cheapest_products
+            WHERE source = ? ORDER BY rank LIMIT ?
+        ''', (source or ALL_SOURCES, limit))
+    ]
+    drop_filter = 'WHERE source = ?' if source else ''
+    drops = [
+        dict(zip(['id', 'name', 'source', 'old_price_cents', 'new_price_cents', 'drop_cents', 'drop_percent', 'changed_at'], row))
+        for row in conn.execute(f'''
+            SELECT * FROM price_drops {drop_filter} ORDER BY drop_cents DESC LIMIT ?
+        ''', ((source,) if source else ()) + (limit,))
+    ]
+    return {'sources': sources, 'cheapest': cheapest, 'price_drops': drops}
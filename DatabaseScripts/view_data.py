@@ -1,47 +1,81 @@
-import sqlite3
+import argparse
 import logging
 import os
+import sys
+from database import DEFAULT_DB_PATH, create_read_connection
+from export import EXPORT_FORMATS, export_products, iter_row_chunks
 
 # Setting up the logging to show messages with timestamps
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Function to fetch and display data from the 'products' table
-def view_data():
-    # Get the directory of the current script and build the path to 'products.db'
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    db_path = os.path.join(script_dir, 'products.db')
-    
+def open_database():
+    """Connect to 'products.db', or return None if it doesn't exist yet."""
+    db_path = DEFAULT_DB_PATH
+
     # Check if the database file exists
     if not os.path.exists(db_path):
         logging.error(f"Database file '{db_path}' not found.")
-        return
-    
-    # Connecting to  database file 'products.db'
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()  # We'll use this cursor to run SQL queries
-    
+        return None
+
+    # Connecting to  database file 'products.db', read-only so a running scrape isn't disturbed
+    conn = create_read_connection(db_path)
+    if conn is None:
+        return None
     logging.info("Successfully connected to the database.")  # Logging the connection status
+    return conn
 
-    # Running an SQL query to get everything from the 'products' table
-    cursor.execute("SELECT * FROM products")
-    rows = cursor.fetchall()  # Fetching all the results
-    
-    logging.info(f"Number of rows fetched: {len(rows)}")  # Log how many rows we got
+# Function to fetch and display data from the 'products' table
+def view_data():
+    conn = open_database()
+    if conn is None:
+        return
 
-    # If  found some rows, print each one; otherwise, let the user know there's no data
-    if rows:
+    # Running an SQL query to get everything from the 'products' table, reading it a chunk at a time
+    row_count = 0
+    for rows in iter_row_chunks(conn, "SELECT * FROM products"):
         for row in rows:
             try:
                 print(row)
             except UnicodeEncodeError:
                 print("Unable to print row due to encoding error.")
                 logging.warning(f"Failed to print row: {row}")  # Log the issue
-    else:
-        print("No data found in the 'products' table.")  # if table is empty
-    
+        row_count += len(rows)
+
+    logging.info(f"Number of rows fetched: {row_count}")  # Log how many rows we got
+
+    # if the table is empty, let the user know there's no data
+    if row_count == 0:
+        print("No data found in the 'products' table.")
+
     # Close the connection to the database when done
     conn.close()
     logging.info("Closed the database connection.")  # Log that we've closed the connection
 
+# Function to dump the 'products' table to a file (or stdout) for offline use
+def export_data(fmt, output_path=None):
+    conn = open_database()
+    if conn is None:
+        return
+
+    # newline='' stops the csv module's line endings being translated a second time
+    output = open(output_path, 'w', encoding='utf-8', newline='') if output_path else sys.stdout
+    try:
+        for piece in export_products(conn, fmt):
+            output.write(piece)
+    finally:
+        if output_path:
+            output.close()
+        conn.close()
+
+    logging.info(f"Exported the products table as {fmt}" + (f" to '{output_path}'." if output_path else "."))
+
 if __name__ == "__main__":
-    view_data()
+    parser = argparse.ArgumentParser(description="View or export the products table.")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), help="stream the table in this format instead of printing rows")
+    parser.add_argument("--output", help="file to write the export to (defaults to stdout)")
+    args = parser.parse_args()
+
+    if args.format:
+        export_data(args.format, args.output)
+    else:
+        view_data()
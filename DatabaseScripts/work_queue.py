@@ -0,0 +1,260 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from database import configure_connection
+
+# The queue crawl workers share, next to this file unless PAGE_QUEUE_DB says otherwise. Put it on
+# storage every worker box can reach, or swap TaskQueue for a class with the same methods over a shared store
+DEFAULT_QUEUE_PATH = os.environ.get('PAGE_QUEUE_DB') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'page_queue.db')
+
+# Seconds a claimed task stays leased to its worker without a heartbeat
+DEFAULT_LEASE_SECONDS = 120
+
+# Claims a task gets, counting leases that expired, before it is quarantined as a poison page
+MAX_ATTEMPTS = 3
+
+# Seconds before a failed task can be claimed again, doubled on every further attempt
+RETRY_BACKOFF_SECONDS = 30
+
+# Columns of a page_tasks row handed to workers
+TASK_COLUMNS = ['id', 'retailer', 'page', 'url', 'attempts']
+
+class TaskQueue:
+    """
+    A page-level crawl job queue in a SQLite file, shared by any number of worker processes.
+
+    There is one task per (retailer, url). A worker claims tasks with a lease, keeps them with
+    heartbeat() while it works, and finishes each with complete(), which hands the products to
+    the writer through page_results, or fail(). A task whose lease runs out (its worker died or
+    hung) goes back on the queue. A task that has been claimed MAX_ATTEMPTS times without being
+    completed is quarantined instead of being retried forever.
+
+    Every state change is a single short IMMEDIATE transaction, so workers never see a task
+    half-claimed. Safe to share between threads.
+    """
+
+    def __init__(self, db_file=DEFAULT_QUEUE_PATH, max_attempts=MAX_ATTEMPTS, retry_backoff=RETRY_BACKOFF_SECONDS):
+        self.db_file = db_file
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._lock = threading.Lock()
+        # Transactions are opened explicitly, so they can take the write lock up front
+        self.conn = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        configure_connection(self.conn)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS page_tasks (
+                id INTEGER PRIMARY KEY,
+                retailer TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                last_error TEXT,
+                updated_at REAL NOT NULL,
+                UNIQUE (retailer, url)
+            );
+            CREATE INDEX IF NOT EXISTS idx_page_tasks_claim ON page_tasks (status, available_at);
+            CREATE TABLE IF NOT EXISTS page_results (
+                id INTEGER PRIMARY KEY,
+                task_id INTEGER NOT NULL,
+                retailer TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                products TEXT NOT NULL,
+                submitted_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS host_slots (
+                host TEXT PRIMARY KEY,
+                next_at REAL NOT NULL
+            );
+        ''')
+
+    def _transaction(self, work):
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = work(self.conn)
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+            return result
+
+    def enqueue(self, retailer, pages):
+        """
+        Queues (page_number, url) tasks for a retailer. A task that already exists is queued
+        again if it was done; queued, leased and quarantined tasks are left as they are.
+
+        Returns:
+            int: The number of tasks added or re-queued.
+        """
+        now = time.time()
+        def work(conn):
+            cursor = conn.executemany('''
+                INSERT INTO page_tasks (retailer, page, url, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (retailer, url) DO UPDATE
+                SET status = 'queued', attempts = 0, available_at = 0, last_error = NULL, updated_at = excluded.updated_at
+                WHERE page_tasks.status = 'done'
+            ''', [(retailer, page, url, now) for page, url in pages])
+            return cursor.rowcount
+        return self._transaction(work)
+
+    def _expire_leases(self, conn, now):
+        """Puts tasks whose lease ran out back on the queue, or in quarantine if they're out of attempts."""
+        conn.execute('''
+            UPDATE page_tasks
+            SET status = CASE WHEN attempts >= ? THEN 'quarantined' ELSE 'queued' END,
+                lease_owner = NULL, lease_expires = NULL, last_error = 'lease expired', updated_at = ?
+            WHERE status = 'leased' AND lease_expires < ?
+        ''', (self.max_attempts, now, now))
+
+    def claim(self, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS, limit=1, retailers=None):
+        """
+        Leases up to limit queued tasks to a worker, oldest first.
+
+        Returns:
+            list of dict: The claimed tasks, with the TASK_COLUMNS keys (attempts includes this claim).
+        """
+        now = time.time()
+        def work(conn):
+            self._expire_leases(conn, now)
+            query = f"SELECT {', '.join(TASK_COLUMNS)} FROM page_tasks WHERE status = 'queued' AND available_at <= ?"
+            params = [now]
+            if retailers:
+                query += f" AND retailer IN ({', '.join('?' * len(retailers))})"
+                params += list(retailers)
+            rows = conn.execute(query + ' ORDER BY id LIMIT ?', params + [limit]).fetchall()
+            conn.executemany('''
+                UPDATE page_tasks
+                SET status = 'leased', attempts = attempts + 1, lease_owner = ?, lease_expires = ?, updated_at = ?
+                WHERE id = ?
+            ''', [(worker_id, now + lease_seconds, now, row[0]) for row in rows])
+            return [dict(zip(TASK_COLUMNS, row[:4] + (row[4] + 1,))) for row in rows]
+        return self._transaction(work)
+
+    def heartbeat(self, task_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Extends a task's lease. Returns False if the worker no longer holds it."""
+        now = time.time()
+        def work(conn):
+            return conn.execute('''
+                UPDATE page_tasks SET lease_expires = ?, updated_at = ?
+                WHERE id = ? AND status = 'leased' AND lease_owner = ?
+            ''', (now + lease_seconds, now, task_id, worker_id)).rowcount == 1
+        return self._transaction(work)
+
+    def complete(self, task_id, worker_id, retailer, page, products):
+        """
+        Marks a task done and submits its products for the writer, in one transaction.
+
+        Returns False, submitting nothing, if the lease was lost: the task may already be
+        with another worker.
+        """
+        now = time.time()
+        def work(conn):
+            owned = conn.execute('''
+                UPDATE page_tasks SET status = 'done', lease_owner = NULL, lease_expires = NULL, last_error = NULL, updated_at = ?
+                WHERE id = ? AND status = 'leased' AND lease_owner = ?
+            ''', (now, task_id, worker_id)).rowcount == 1
+            if owned:
+                conn.execute('''
+                    INSERT INTO page_results (task_id, retailer, page, products, submitted_at) VALUES (?, ?, ?, ?, ?)
+                ''', (task_id, retailer, page, json.dumps(products, ensure_ascii=False), now))
+            return owned
+        return self._transaction(work)
+
+    def fail(self, task_id, worker_id, error):
+        """
+        Gives a task back after a failed attempt. It is retried after a back-off, or quarantined
+        once it has used up its attempts.
+
+        Returns:
+            str: The task's new status, or None if the worker no longer held it.
+        """
+        now = time.time()
+        def work(conn):
+            row = conn.execute("SELECT attempts FROM page_tasks WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                               (task_id, worker_id)).fetchone()
+            if row is None:
+                return None
+            status = 'quarantined' if row[0] >= self.max_attempts else 'queued'
+            conn.execute('''
+                UPDATE page_tasks SET status = ?, available_at = ?, lease_owner = NULL, lease_expires = NULL,
+                    last_error = ?, updated_at = ?
+                WHERE id = ?
+            ''', (status, now + self.retry_backoff * 2 ** (row[0] - 1), str(error)[:500], now, task_id))
+            return status
+        return self._transaction(work)
+
+    def reserve_slot(self, host, interval):
+        """
+        Reserves the next request slot for a host, so every worker using the queue keeps to one
+        request rate per host between them. Slots are interval seconds apart, timed by the
+        workers' clocks.
+
+        Returns:
+            float: Seconds the worker has to wait before sending its request.
+        """
+        now = time.time()
+        def work(conn):
+            row = conn.execute('SELECT next_at FROM host_slots WHERE host = ?', (host,)).fetchone()
+            slot = max(now, row[0]) if row else now
+            conn.execute('''
+                INSERT INTO host_slots (host, next_at) VALUES (?, ?)
+                ON CONFLICT (host) DO UPDATE SET next_at = excluded.next_at
+            ''', (host, slot + interval))
+            return slot - now
+        return self._transaction(work)
+
+    def take_results(self, limit=100):
+        """Returns up to limit submitted pages as (result_id, retailer, page, products), oldest first."""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT id, retailer, page, products FROM page_results ORDER BY id LIMIT ?', (limit,)).fetchall()
+        return [(row[0], row[1], row[2], json.loads(row[3])) for row in rows]
+
+    def delete_results(self, result_ids):
+        """Removes results the writer has stored."""
+        def work(conn):
+            conn.executemany('DELETE FROM page_results WHERE id = ?', [(result_id,) for result_id in result_ids])
+        self._transaction(work)
+
+    def counts(self):
+        """Returns the number of tasks in each status, plus 'results' waiting for the writer."""
+        def work(conn):
+            self._expire_leases(conn, time.time())
+            counts = {'queued': 0, 'leased': 0, 'done': 0, 'quarantined': 0}
+            counts.update(conn.execute('SELECT status, COUNT(*) FROM page_tasks GROUP BY status').fetchall())
+            counts['results'] = conn.execute('SELECT COUNT(*) FROM page_results').fetchone()[0]
+            return counts
+        return self._transaction(work)
+
+    def quarantined(self):
+        """Returns the quarantined tasks as dicts with retailer, page, url, attempts and last_error."""
+        with self._lock:
+            rows = self.conn.execute('''
+                SELECT retailer, page, url, attempts, last_error FROM page_tasks WHERE status = 'quarantined' ORDER BY id
+            ''').fetchall()
+        return [dict(zip(['retailer', 'page', 'url', 'attempts', 'last_error'], row)) for row in rows]
+
+    def release_quarantined(self, retailer=None):
+        """Puts quarantined tasks back on the queue with fresh attempts, e.g. after a selector fix. Returns how many."""
+        now = time.time()
+        def work(conn):
+            query = '''
+                UPDATE page_tasks SET status = 'queued', attempts = 0, available_at = 0, last_error = NULL, updated_at = ?
+                WHERE status = 'quarantined'
+            '''
+            params = [now]
+            if retailer is not None:
+                query += ' AND retailer = ?'
+                params.append(retailer)
+            return conn.execute(query, params).rowcount
+        return self._transaction(work)
+
+    def close(self):
+        self.conn.close()
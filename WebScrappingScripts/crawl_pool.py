@@ -0,0 +1,113 @@
+import logging
+import queue
+import threading
+import time
+from urllib.parse import urlparse
+from metrics import increment, profile_page, timer
+from rate_limiter import get_rate_limiter
+
+# Logging setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def iter_crawl_pages(page_numbers, scrape_page, create_driver, page_url, workers, rate_limit=None, retailer=None):
+    """
+    Crawls a retailer's pages with a pool of browser drivers, yielding each page as it completes.
+
+    Args:
+        page_numbers (iterable of int): The pages to crawl.
+        scrape_page (callable): scrape_page(driver, page_number) -> list of product dicts,
+            or None when the page couldn't be loaded. It reports its page loads to the host's
+            rate limiter itself, timing only the load and not the waits for rendering.
+        create_driver (callable): Creates a new WebDriver; every worker thread gets its own.
+        page_url (callable): page_url(page_number) -> URL, used to find the host's rate limiter.
+        workers (int): Number of drivers in the pool.
+        rate_limit (dict): The retailer's rate limiter settings. The limiter is shared per host,
+            so the whole pool keeps to one request rate however many drivers it has.
+        retailer (str): Name the pages' timings and counts are recorded under in metrics;
+            defaults to the host.
+
+    Yields:
+        tuple: (page_number, products) in page order, with products set to None for a page that
+        couldn't be loaded or raised an error. Pages that finish early are held back only until
+        the pages before them are done, so at most a few pages per driver are buffered.
+    """
+    page_numbers = list(page_numbers)
+    if not page_numbers:
+        return
+
+    limiter = get_rate_limiter(page_url(page_numbers[0]), rate_limit)
+    retailer = retailer or urlparse(page_url(page_numbers[0])).netloc
+    pending = queue.Queue()
+    for page_number in page_numbers:
+        pending.put(page_number)
+
+    # Workers report (page_number, products) here, and None when they exit
+    finished = queue.Queue()
+    stop = threading.Event()
+    started_drivers = []
+
+    def worker():
+        try:
+            driver = create_driver()
+        except Exception as e:
+            logging.error(f"Failed to start a driver for the crawl pool: {e}")
+            finished.put(None)
+            return
+        started_drivers.append(driver)
+
+        try:
+            while not stop.is_set():
+                try:
+                    page_number = pending.get_nowait()
+                except queue.Empty:
+                    break
+
+                with timer("rate_limit_wait_seconds", retailer=retailer):
+                    limiter.acquire()
+                started = time.monotonic()
+                try:
+                    with profile_page(retailer, page_number), timer("page_seconds", retailer=retailer, fetch="browser"):
+                        products = scrape_page(driver, page_number)
+                except Exception as e:
+                    logging.error(f"Error scraping page {page_number}: {e}")
+                    products = None
+                    limiter.record(time.monotonic() - started, ok=False)
+                increment("pages_total", retailer=retailer, fetch="browser", result="ok" if products is not None else "failed")
+
+                finished.put((page_number, products))
+        finally:
+            driver.quit()
+            finished.put(None)
+
+    threads = [threading.Thread(target=worker, name=f"crawl-pool-{i}") for i in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+
+    buffered = {}
+    next_index = 0
+    running = len(threads)
+    try:
+        while running:
+            item = finished.get()
+            if item is None:
+                running -= 1
+                continue
+
+            buffered[item[0]] = item[1]
+            # Release every page whose predecessors are all done
+            while next_index < len(page_numbers) and page_numbers[next_index] in buffered:
+                page_number = page_numbers[next_index]
+                yield page_number, buffered.pop(page_number)
+                next_index += 1
+
+        if not started_drivers:
+            raise RuntimeError("None of the crawl pool's drivers could be started")
+
+        # Only reached with pages left over if a driver failed to start; hand them over as failed
+        for page_number in page_numbers[next_index:]:
+            yield page_number, buffered.get(page_number)
+    finally:
+        # Also reached when the consumer stops early: let the drivers finish their current page and quit
+        stop.set()
+        for thread in threads:
+            thread.join()
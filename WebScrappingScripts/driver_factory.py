@@ -0,0 +1,188 @@
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import SessionNotCreatedException
+import atexit
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+# Logging setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Where the resolved chromedriver path is remembered between runs
+DRIVER_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.driver_cache.json')
+
+# Desktop user agent sent by every scraper
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/104.0.0.0 Safari/537.36"
+
+# Requests the scrapers never need: we only read the src attribute of product images
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3",
+    # Third-party analytics, ads and chat scripts
+    "*googletagmanager.com*", "*google-analytics.com*", "*doubleclick.net*", "*facebook.net*",
+    "*hotjar.com*", "*newrelic.com*", "*nr-data.net*", "*clarity.ms*", "*tiktok.com*", "*zendesk.com*",
+]
+STYLESHEET_PATTERNS = ["*.css"]
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+def is_offline():
+    """True when SCRAPER_OFFLINE is set, in which case the driver is never looked up online."""
+    return os.environ.get("SCRAPER_OFFLINE", "") not in ("", "0")
+
+def resolve_driver_path():
+    """
+    Returns the path of a chromedriver binary, doing the network version check at most once.
+
+    The order is: the CHROMEDRIVER_PATH environment variable, the path already resolved in this
+    process, the path cached by an earlier run, chromedriver on the PATH when offline, and
+    finally webdriver-manager, whose answer is then cached for next time.
+    """
+    global _driver_path
+    with _driver_path_lock:
+        if os.environ.get("CHROMEDRIVER_PATH"):
+            return os.environ["CHROMEDRIVER_PATH"]
+        if _driver_path and os.path.exists(_driver_path):
+            return _driver_path
+
+        try:
+            with open(DRIVER_CACHE_FILE, encoding='utf-8') as cache:
+                cached_path = json.load(cache).get("path")
+            if cached_path and os.path.exists(cached_path):
+                _driver_path = cached_path
+                return _driver_path
+        except (OSError, ValueError):
+            pass
+
+        if is_offline():
+            found = shutil.which("chromedriver")
+            if found is None:
+                raise RuntimeError("Offline mode: no cached chromedriver and none on the PATH; set CHROMEDRIVER_PATH.")
+            _driver_path = found
+            return _driver_path
+
+        from webdriver_manager.chrome import ChromeDriverManager#type:ignore
+        _driver_path = ChromeDriverManager().install()
+        try:
+            with open(DRIVER_CACHE_FILE, 'w', encoding='utf-8') as cache:
+                json.dump({"path": _driver_path}, cache)
+        except OSError as e:
+            logging.warning(f"Couldn't cache the chromedriver path: {e}")
+        return _driver_path
+
+def forget_driver_path():
+    """Drops the resolved chromedriver path, here and in the cache file, so the next lookup checks online again."""
+    global _driver_path
+    with _driver_path_lock:
+        _driver_path = None
+        try:
+            os.remove(DRIVER_CACHE_FILE)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Couldn't remove the cached chromedriver path: {e}")
+
+def chrome_options(window_size=None, user_agent=USER_AGENT):
+    """Builds headless Chrome options with a lightweight profile that doesn't download images."""
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    if window_size:
+        options.add_argument(f"--window-size={window_size}")
+    if user_agent:
+        options.add_argument(f"--user-agent={user_agent}")
+    options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.managed_default_content_settings.media_stream": 2,
+        "profile.managed_default_content_settings.notifications": 2,
+    })
+    return options
+
+def block_requests(driver, block_stylesheets=True):
+    """Blocks images, fonts, media and third-party scripts (and optionally CSS) through the DevTools protocol."""
+    patterns = BLOCKED_URL_PATTERNS + (STYLESHEET_PATTERNS if block_stylesheets else [])
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    except Exception as e:
+        logging.warning(f"Couldn't set blocked URLs: {e}")
+
+def create_driver(window_size=None, user_agent=USER_AGENT, block_stylesheets=True):
+    """
+    Starts a new headless Chrome with the lightweight profile and logs how long startup took.
+
+    block_stylesheets can be turned off for pages whose lazy loading depends on layout.
+    If the cached chromedriver no longer matches Chrome (usually after Chrome updated itself),
+    the cache is dropped and the driver looked up again once, unless running offline.
+    """
+    started = time.monotonic()
+    try:
+        driver = webdriver.Chrome(service=Service(resolve_driver_path()), options=chrome_options(window_size, user_agent))
+    except SessionNotCreatedException as e:
+        if is_offline() or os.environ.get("CHROMEDRIVER_PATH"):
+            raise
+        logging.warning(f"Couldn't start Chrome with the cached chromedriver, looking it up again: {e}")
+        forget_driver_path()
+        driver = webdriver.Chrome(service=Service(resolve_driver_path()), options=chrome_options(window_size, user_agent))
+    block_requests(driver, block_stylesheets)
+    logging.info(f"Chrome started in {time.monotonic() - started:.2f}s")
+    return driver
+
+class SharedDriver:
+    """
+    Wraps the process-wide browser so callers can treat it like their own driver.
+
+    quit() does nothing, so a scraper that is done with it leaves it running for the next
+    page or retailer; the browser is closed by quit_shared_driver() or at exit.
+    """
+
+    def __init__(self, driver):
+        self._driver = driver
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+    def quit(self):
+        pass
+
+_shared_driver = None
+_shared_driver_lock = threading.Lock()
+
+def get_shared_driver(block_stylesheets=True):
+    """
+    Returns the browser shared by every scraper in this process, starting it on first use.
+
+    Only one thread should use it at a time; crawl pools with several drivers start their own.
+    The blocked-URL list is reapplied so each retailer gets its own stylesheet setting.
+    """
+    global _shared_driver
+    with _shared_driver_lock:
+        if _shared_driver is None:
+            _shared_driver = create_driver(window_size="1920,1080")
+            atexit.register(quit_shared_driver)
+        else:
+            logging.info("Reusing the shared Chrome instance")
+        block_requests(_shared_driver, block_stylesheets)
+        return SharedDriver(_shared_driver)
+
+def quit_shared_driver():
+    """Closes the shared browser, if one was started."""
+    global _shared_driver
+    with _shared_driver_lock:
+        if _shared_driver is not None:
+            try:
+                _shared_driver.quit()
+            except Exception as e:
+                logging.debug(f"Error closing the shared driver: {e}")
+            _shared_driver = None
@@ -0,0 +1,33 @@
+from bs4 import BeautifulSoup
+from urllib.parse import urljoin
+
+def parse_html(html):
+    """Parses an HTML document with the lxml parser, which is much faster than html.parser."""
+    return BeautifulSoup(html, "lxml")
+
+def select_text(element, selector):
+    """
+    Returns the whitespace-normalised text of the first match of selector inside element,
+    or None when there is no match or it has no text (the same as an empty Selenium .text).
+    """
+    found = element.select_one(selector)
+    if found is None:
+        return None
+    text = " ".join(found.get_text().split())
+    return text or None
+
+def select_attribute(element, selector, *attributes, base_url=None):
+    """
+    Returns the first non-empty attribute of the first match of selector inside element.
+
+    Several attribute names can be given, e.g. "src" then "data-src" for lazily loaded images.
+    When base_url is given relative URLs are made absolute, like Selenium's get_attribute does.
+    """
+    found = element.select_one(selector)
+    if found is None:
+        return None
+    for attribute in attributes:
+        value = found.get(attribute)
+        if value:
+            return urljoin(base_url, value) if base_url else value
+    return None
@@ -0,0 +1,139 @@
+import itertools
+import logging
+import time
+from collections import deque
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from crawl_pool import iter_crawl_pages
+from metrics import increment, profile_page, timer
+from page_archive import archive_page, get_archive
+from rate_limiter import get_rate_limiter
+
+# Logging setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Same desktop user agent the Checkers scraper gives Chrome
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/104.0.0.0 Safari/537.36"
+
+class HttpBackend:
+    """
+    Downloads listing pages over a pooled, keep-alive HTTP session.
+
+    Any object with a fetch(url) -> str method can be used in its place, e.g. to
+    serve fixture pages in tests.
+    """
+
+    def __init__(self, pool_size=8, timeout=30, retries=2):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": USER_AGENT,
+            "Accept": "text/html,application/xhtml+xml",
+            "Accept-Language": "en-ZA,en;q=0.9",
+        })
+        # Connections are kept alive and reused across pages; transient server errors are retried
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, backoff_factor=1, status_forcelist=(500, 502, 503, 504)),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, url):
+        """Returns the HTML of the page at url, raising for HTTP errors."""
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def close(self):
+        self.session.close()
+
+def iter_fetch_pages(page_numbers, page_url, parse_page, scrape_page, create_driver, workers, rate_limit=None, backend=None,
+                     retailer=None):
+    """
+    Downloads and parses listing pages without a browser, yielding each page as it is parsed.
+
+    Pages rendered client-side (such as Pick n Pay's Angular grid) come back without product
+    cards in the initial HTML. Those, and pages that couldn't be downloaded, are loaded in a
+    browser through the crawl pool once the HTTP pass is done.
+
+    Args:
+        page_numbers (iterable of int): The pages to fetch.
+        page_url (callable): page_url(page_number) -> URL.
+        parse_page (callable): parse_page(html) -> list of product dicts, or None if the grid is missing.
+        scrape_page (callable): The module's Selenium scrape_page, used for the fallback.
+        create_driver (callable): The module's create_driver, used for the fallback.
+        workers (int): Number of pages fetched at the same time, and drivers used for the fallback.
+        rate_limit (dict): The retailer's rate limiter settings; the limiter is shared per host
+            with any browser crawl of the same site.
+        backend: Object with a fetch(url) method; defaults to a new HttpBackend.
+        retailer (str): Name to archive downloaded pages under when page archiving is on, and to
+            record their timings and counts under in metrics (which otherwise use the host).
+
+    Yields:
+        tuple: (page_number, products), in page order for the HTTP pages, followed by the fallback pages.
+    """
+    page_numbers = list(page_numbers)
+    if not page_numbers:
+        return
+
+    own_backend = backend is None
+    if own_backend:
+        backend = HttpBackend(pool_size=max(1, workers))
+    limiter = get_rate_limiter(page_url(page_numbers[0]), rate_limit)
+    label = retailer or urlparse(page_url(page_numbers[0])).netloc
+
+    def fetch_one(page_number):
+        with timer("rate_limit_wait_seconds", retailer=label):
+            limiter.acquire()
+        logging.info(f"Fetching page {page_number} over HTTP...")
+        with profile_page(label, page_number), timer("page_seconds", retailer=label, fetch="http"):
+            started = time.monotonic()
+            try:
+                with timer("stage_seconds", retailer=label, stage="download"):
+                    html = backend.fetch(page_url(page_number))
+            except Exception as e:
+                logging.warning(f"HTTP fetch failed for page {page_number}: {e}")
+                limiter.record(time.monotonic() - started, ok=False)
+                increment("pages_total", retailer=label, fetch="http", result="failed")
+                return None
+            limiter.record(time.monotonic() - started)
+            if retailer and get_archive() is not None:
+                with timer("stage_seconds", retailer=label, stage="archive"):
+                    archive_page(retailer, page_number, page_url(page_number), html)
+            with timer("stage_seconds", retailer=label, stage="extract"):
+                products = parse_page(html)
+        increment("pages_total", retailer=label, fetch="http", result="ok" if products is not None else "grid_missing")
+        return products
+
+    missing = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            # Only keep a small window of pages in flight so parsed pages don't pile up in memory
+            window = max(1, workers) * 2
+            in_flight = deque()
+            remaining = iter(page_numbers)
+            for page_number in itertools.islice(remaining, window):
+                in_flight.append((page_number, executor.submit(fetch_one, page_number)))
+
+            while in_flight:
+                page_number, future = in_flight.popleft()
+                for next_page in itertools.islice(remaining, 1):
+                    in_flight.append((next_page, executor.submit(fetch_one, next_page)))
+
+                products = future.result()
+                if products is None:
+                    missing.append(page_number)
+                else:
+                    yield page_number, products
+    finally:
+        if own_backend:
+            backend.close()
+
+    if missing:
+        logging.info(f"Product grid missing from {len(missing)} page(s), falling back to Selenium...")
+        yield from iter_crawl_pages(missing, scrape_page, create_driver, page_url, workers, rate_limit, retailer)
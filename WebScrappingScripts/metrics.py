@@ -0,0 +1,232 @@
+import bisect
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Logging setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Histogram bucket upper bounds in seconds, from a fast parse to a page that hit every timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Where slow-page profiles are written unless SCRAPER_PROFILE_DIR says otherwise
+DEFAULT_PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+
+# How often the sampling profiler looks at the profiled thread's stack, in seconds
+PROFILE_INTERVAL = 0.005
+
+class Histogram:
+    """Counts observations into fixed buckets and keeps their sum, like a Prometheus histogram."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one counts everything above the top bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+    def merge(self, data):
+        """Adds a histogram from to_dict() (e.g. from a worker process) into this one."""
+        if tuple(data['buckets']) != self.buckets:
+            raise ValueError("Can't merge histograms with different buckets")
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, data['counts'])]
+        self.sum += data['sum']
+        self.count += data['count']
+
+class MetricsRegistry:
+    """
+    Histograms and counters for one process, keyed by metric name and labels. Safe to share between threads.
+
+    snapshot() turns everything into plain data that can be stored as JSON, sent between
+    processes and merged into another registry with merge().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = collections.Counter()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: 'histograms' and 'counters', each a list of {'name', 'labels', ...} entries.
+        """
+        with self._lock:
+            return {
+                'histograms': [dict(histogram.to_dict(), name=name, labels=dict(labels))
+                               for (name, labels), histogram in sorted(self._histograms.items())],
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self._counters.items())],
+            }
+
+    def merge(self, snapshot):
+        with self._lock:
+            for entry in snapshot.get('histograms', []):
+                key = (entry['name'], tuple(sorted(entry['labels'].items())))
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(entry['buckets'])
+                histogram.merge(entry)
+            for entry in snapshot.get('counters', []):
+                self._counters[(entry['name'], tuple(sorted(entry['labels'].items())))] += entry['value']
+
+    def total(self, name, **labels):
+        """The sum of a counter over every label set that includes the given labels."""
+        wanted = set(labels.items())
+        with self._lock:
+            return sum(value for (counter, counter_labels), value in self._counters.items()
+                       if counter == name and wanted <= set(counter_labels))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+# The registry every scraper, crawl pool and the connector in this process record to
+registry = MetricsRegistry()
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+def increment(name, amount=1, **labels):
+    registry.increment(name, amount, **labels)
+
+@contextmanager
+def timer(name, **labels):
+    """Times the block and records its duration in seconds in the named histogram, even if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - started, **labels)
+
+def format_labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in sorted(labels.items()))
+    return '{' + ','.join(escaped) + '}'
+
+def render_prometheus(snapshot, prefix=''):
+    """Renders a registry snapshot in the Prometheus text exposition format."""
+    lines = []
+    seen = set()
+    for entry in snapshot.get('histograms', []):
+        name = prefix + entry['name']
+        if name not in seen:
+            lines.append(f'# TYPE {name} histogram')
+            seen.add(name)
+        cumulative = 0
+        for bound, count in zip(entry['buckets'], entry['counts']):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels(entry['labels'], le=bound)} {cumulative}")
+        lines.append(f"{name}_bucket{format_labels(entry['labels'], le='+Inf')} {entry['count']}")
+        lines.append(f"{name}_sum{format_labels(entry['labels'])} {entry['sum']}")
+        lines.append(f"{name}_count{format_labels(entry['labels'])} {entry['count']}")
+    for entry in snapshot.get('counters', []):
+        name = prefix + entry['name']
+        if name not in seen:
+            lines.append(f'# TYPE {name} counter')
+            seen.add(name)
+        lines.append(f"{name}{format_labels(entry['labels'])} {entry['value']}")
+    return '\n'.join(lines) + '\n'
+
+class SamplingProfiler:
+    """
+    Samples one thread's call stack every PROFILE_INTERVAL seconds from a background thread.
+
+    Cheap enough to leave on for every page: nothing is hooked into the profiled code, and the
+    samples are only written out when the page turns out to be slow.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="page-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        """Writes the samples in collapsed-stack format, which flame graph tools read directly."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as output:
+            for stack, count in self.samples.most_common():
+                output.write(f'{stack} {count}\n')
+
+def slow_page_threshold():
+    """Seconds after which a page's profile is kept, from SCRAPER_PROFILE_SLOW_PAGES, or None when profiling is off."""
+    try:
+        threshold = float(os.environ.get("SCRAPER_PROFILE_SLOW_PAGES", ""))
+    except ValueError:
+        return None
+    return threshold if threshold > 0 else None
+
+@contextmanager
+def profile_page(retailer, page_number):
+    """
+    Profiles the block with the sampling profiler when SCRAPER_PROFILE_SLOW_PAGES is set, and keeps
+    the profile (under SCRAPER_PROFILE_DIR) only if the page took longer than that many seconds.
+    """
+    threshold = slow_page_threshold()
+    if threshold is None:
+        yield
+        return
+
+    profiler = SamplingProfiler(threading.get_ident())
+    profiler.start()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        elapsed = time.perf_counter() - started
+        if elapsed >= threshold and profiler.samples:
+            path = os.path.join(os.environ.get("SCRAPER_PROFILE_DIR") or DEFAULT_PROFILE_DIR,
+                                f"{retailer}-page{page_number}-{int(time.time())}.folded")
+            try:
+                profiler.write(path)
+                logging.info(f"{retailer} page {page_number} took {elapsed:.1f}s; profile written to {path}")
+            except OSError as e:
+                logging.warning(f"Couldn't write the profile of {retailer} page {page_number}: {e}")
@@ -0,0 +1,161 @@
+import argparse
+import gzip
+import hashlib
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+# Logging setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Where pages are archived when SCRAPER_ARCHIVE_DIR is set without a path, and where replay looks by default
+DEFAULT_ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'page_archive')
+
+# Scraper modules with pages in the archive, by the name they archive under
+RETAILER_MODULES = ["checkers", "picknpay", "woolworths"]
+
+class PageArchive:
+    """
+    A compressed, content-addressed store of listing page HTML.
+
+    Each distinct page body is gzipped once under objects/<first 2 hex digits>/<sha256>.html.gz,
+    so a page that hasn't changed since the last crawl costs nothing to archive again.
+    manifest.jsonl has one line per save (retailer, page, url, sha256, size, saved_at), and the
+    latest line for a page is its current version. Safe to use from several threads and processes.
+    """
+
+    def __init__(self, root=DEFAULT_ARCHIVE_DIR):
+        self.root = root
+        self.manifest_path = os.path.join(root, 'manifest.jsonl')
+        self._lock = threading.Lock()
+
+    def object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], f'{digest}.html.gz')
+
+    def save(self, retailer, page_number, url, html):
+        """Stores a page's HTML and records it in the manifest. Returns the content hash."""
+        data = html.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so a reader never sees half an object
+            temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with gzip.open(temporary, 'wb') as output:
+                output.write(data)
+            os.replace(temporary, path)
+
+        entry = {
+            "retailer": retailer,
+            "page": page_number,
+            "url": url,
+            "sha256": digest,
+            "size": len(data),
+            "saved_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+        with self._lock:
+            # One short append per line, so lines from concurrent processes don't interleave
+            with open(self.manifest_path, 'a', encoding='utf-8') as manifest:
+                manifest.write(json.dumps(entry) + '\n')
+        return digest
+
+    def load(self, digest):
+        """Returns the archived HTML with the given content hash."""
+        with gzip.open(self.object_path(digest), 'rb') as archived:
+            return archived.read().decode('utf-8')
+
+    def entries(self, retailer=None):
+        """Returns the latest manifest entry of every archived page, ordered by retailer and page."""
+        latest = {}
+        try:
+            with open(self.manifest_path, encoding='utf-8') as manifest:
+                for line in manifest:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by a crash
+                    if retailer is None or entry["retailer"] == retailer:
+                        latest[(entry["retailer"], entry["page"])] = entry
+        except FileNotFoundError:
+            return []
+        return [latest[key] for key in sorted(latest)]
+
+    def iter_pages(self, retailer):
+        """Yields (page_number, html) for every archived page of a retailer, in page order."""
+        for entry in self.entries(retailer):
+            yield entry["page"], self.load(entry["sha256"])
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+def get_archive():
+    """
+    Returns the archive scraped pages should be saved to, or None when archiving is off.
+
+    Archiving is switched on by the SCRAPER_ARCHIVE_DIR environment variable (which worker
+    processes inherit); "1" means DEFAULT_ARCHIVE_DIR.
+    """
+    root = os.environ.get("SCRAPER_ARCHIVE_DIR", "")
+    if root in ("", "0"):
+        return None
+    if root == "1":
+        root = DEFAULT_ARCHIVE_DIR
+    with _archives_lock:
+        if root not in _archives:
+            _archives[root] = PageArchive(root)
+        return _archives[root]
+
+def archive_page(retailer, page_number, url, html):
+    """Saves a scraped page if archiving is on. Failing to archive never fails the crawl."""
+    archive = get_archive()
+    if archive is None or html is None:
+        return
+    try:
+        archive.save(retailer, page_number, url, html)
+    except OSError as e:
+        logging.warning(f"Couldn't archive page {page_number} of {retailer}: {e}")
+
+def replay(archive, retailers, print_products=False):
+    """
+    Runs each retailer definition's parse_product_info over its archived pages, without a browser
+    or network, and logs what was extracted.
+
+    Returns:
+        dict: Per retailer, the number of 'pages', 'products' and pages with the product 'grid_missing'.
+    """
+    summary = {}
+    for retailer in retailers:
+        scraper = importlib.import_module(retailer).RETAILER
+        counts = {"pages": 0, "products": 0, "grid_missing": 0}
+        started = time.monotonic()
+        for page_number, html in archive.iter_pages(retailer):
+            products = scraper.parse_product_info(html)
+            counts["pages"] += 1
+            if products is None:
+                counts["grid_missing"] += 1
+                logging.warning(f"{retailer} page {page_number}: product grid not found")
+                continue
+            counts["products"] += len(products)
+            if print_products:
+                for product in products:
+                    print(json.dumps(dict(product, page=page_number), ensure_ascii=False))
+        logging.info(f"{retailer}: re-parsed {counts['pages']} pages in {time.monotonic() - started:.2f}s: {counts}")
+        summary[retailer] = counts
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-parse archived listing pages offline with the scrapers' current selectors.")
+    parser.add_argument("retailers", nargs="*", help=f"retailers to replay, from {', '.join(RETAILER_MODULES)} (default: all)")
+    parser.add_argument("--archive", default=DEFAULT_ARCHIVE_DIR, help="archive directory")
+    parser.add_argument("--products", action="store_true", help="print every extracted product as a JSON line")
+    args = parser.parse_args()
+    unknown = set(args.retailers) - set(RETAILER_MODULES)
+    if unknown:
+        parser.error(f"unknown retailer(s): {', '.join(sorted(unknown))}")
+    sys.stdout.reconfigure(encoding='utf-8')
+    replay(PageArchive(args.archive), args.retailers or RETAILER_MODULES, print_products=args.products)
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+# Logging setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Used for any setting a retailer's RATE_LIMIT doesn't give
+DEFAULT_RATE_LIMIT = {
+    "rate": 0.5,            # Page requests per second to start with
+    "burst": 1,             # Requests that can go out back to back after an idle spell
+    "min_rate": 0.05,       # Slowest the limiter backs off to
+    "max_rate": 2.0,        # Fastest the limiter speeds up to
+    "slow_response": 15.0,  # Seconds after which a page load counts as slow
+    "backoff": 0.5,         # Rate multiplier after a slow or failed page
+    "speedup": 1.1,         # Rate multiplier after a run of healthy pages
+    "healthy_streak": 5,    # Healthy pages in a row needed before speeding up
+}
+
+class AdaptiveRateLimiter:
+    """
+    Token-bucket rate limiter for one host that adapts to how the site is coping.
+
+    Tokens refill at the current rate up to burst; acquire() takes one, waiting if needed.
+    A caller that has to wait reserves its slot by taking the balance below zero, so callers
+    are served in order without holding the lock while they sleep.
+    After every page the caller reports how it went with record(): a failed or slow page cuts
+    the rate (multiplicative back-off), and a streak of healthy pages raises it again, always
+    within min_rate and max_rate. Safe to share between threads.
+    """
+
+    def __init__(self, **config):
+        settings = dict(DEFAULT_RATE_LIMIT, **config)
+        self.rate = settings["rate"]
+        self.burst = settings["burst"]
+        self.min_rate = settings["min_rate"]
+        self.max_rate = settings["max_rate"]
+        self.slow_response = settings["slow_response"]
+        self.backoff = settings["backoff"]
+        self.speedup = settings["speedup"]
+        self.healthy_streak = settings["healthy_streak"]
+
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._streak = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Blocks until a request to the host is allowed."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        # Sleep without the lock, so record() calls from other workers aren't held up
+        if wait > 0:
+            time.sleep(wait)
+
+    def record(self, elapsed, ok=True):
+        """Reports how long a page took and whether it succeeded, adjusting the rate."""
+        with self._lock:
+            if not ok or elapsed > self.slow_response:
+                self._streak = 0
+                new_rate = max(self.min_rate, self.rate * self.backoff)
+                if new_rate != self.rate:
+                    logging.info(f"Backing off to {new_rate:.3f} requests/s after a {'failed' if not ok else 'slow'} page.")
+                self.rate = new_rate
+                # Don't let a burst go out straight after a failure
+                self._tokens = min(self._tokens, 0)
+            else:
+                self._streak += 1
+                if self._streak >= self.healthy_streak:
+                    self._streak = 0
+                    self.rate = min(self.max_rate, self.rate * self.speedup)
+
+# One limiter per host, so every pool, HTTP fetcher and serial loop crawling a site shares it
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(url, config=None):
+    """Returns the shared rate limiter for the host of the given URL, creating it from config on first use."""
+    host = urlparse(url).netloc
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = AdaptiveRateLimiter(**(config or {}))
+        return _limiters[host]
+
+def set_rate_limiter(url, config=None, limiter=None):
+    """
+    Replaces the limiter for the host of the given URL, e.g. to lift the limit when crawling local
+    fixtures. A ready-made limiter (anything with acquire() and record()) can be given instead of config.
+    """
+    host = urlparse(url).netloc
+    with _limiters_lock:
+        _limiters[host] = limiter or AdaptiveRateLimiter(**(config or {}))
+        return _limiters[host]
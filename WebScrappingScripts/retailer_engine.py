@@ -0,0 +1,432 @@
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+import logging
+import time
+import traceback
+from crawl_pool import iter_crawl_pages
+import driver_factory
+from http_fetch import iter_fetch_pages
+from metrics import increment, observe, timer
+from page_archive import archive_page, get_archive
+from rate_limiter import get_rate_limiter
+from waits import scroll_until_stable, wait_for_count_to_settle, wait_for_page_load
+from html_parsing import parse_html, select_attribute, select_text
+
+# Logging setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Pages crawled at a time past the expected end of a catalogue, for as long as they keep coming back full
+EXTEND_PAGES = 10
+
+# Most pages crawled past the expected end, in case a site serves its last page again for every page after it
+MAX_EXTRA_PAGES = 100
+
+# Seconds a rendered grid has to stay without cards before it is taken for an empty page, rather than one still loading
+EMPTY_GRID_SECONDS = 5
+
+# Seconds the catalogue size found by a crawl that reached the end is trusted before the definition's is used again
+PAGE_COUNT_TTL_SECONDS = 6 * 3600
+
+class ListingPage(list):
+    """
+    The products parsed from one listing page, with what the page showed about the end of the catalogue.
+
+    It is a plain list of product dicts everywhere the scrapers' results go (and survives pickling
+    between processes); cards is the number of product cards in the loaded grid and last is True
+    when that grid was empty or short of a full page, so the page is the catalogue's last one, or past it.
+    """
+
+    def __init__(self, products=(), cards=0, last=False):
+        super().__init__(products)
+        self.cards = cards
+        self.last = last
+
+def is_last_page(products):
+    """Whether a scraped page's products came from the last page of its catalogue."""
+    return getattr(products, 'last', False)
+
+def catalogue_page_count(page_number, products):
+    """The catalogue's page count implied by its last page: an empty one is past the end rather than on it."""
+    return page_number + 1 if products else page_number
+
+class Retailer:
+    """
+    One retailer's listing pages, described by a definition, and the engine that scrapes them.
+
+    Every retailer is crawled the same way: page_url() fills in the URL template, the page is loaded
+    over HTTP or in Chrome, its product cards are parsed with the card selectors, and the crawl stops
+    at the end of the catalogue. A retailer module only holds its definition, as RETAILER, whose
+    methods are the scraper API the connector, scheduler, queue workers and page replay use.
+
+    Args:
+        name (str): Module name, which metrics, the page archive and replay know the retailer by.
+        source (str): Source label stored with every product.
+        base_url (str): Site root, used to make relative image URLs absolute.
+        url_template (str): Listing page URL with a {page} number, or an {offset} of page * page_size
+            for sites that page by product offset; {page_size} is filled in as well.
+        grid_selector (str): CSS selector of the product grid; a page without it wasn't rendered.
+        item_selector (str): CSS selector of a product card.
+        image_selector (str): CSS selector of the card's image.
+        name_selectors (tuple of str): CSS selectors of the card's name, tried in order.
+        price_selectors (tuple of str): CSS selectors of the card's price, tried in order, so a
+            promo price can be listed ahead of the regular one.
+        page_count (int): Listing pages in the catalogue when it was last counted. Used when the
+            end hasn't been found; a whole-catalogue crawl still carries on past it while pages come back full.
+        page_size (int): Products on a full page, if the site always fills its pages. A page with
+            fewer cards is the last one.
+        wait_selector (str): Element the browser waits for before the grid, for sites that render
+            the grid's container before their scripts have finished (default: the grid).
+        settle_selector (str): Elements whose count has to stop changing before the page is read
+            (default: the cards).
+        require_all_fields (bool): Skip cards missing any of image, name and price, rather than only
+            cards with none of them.
+        scroll (bool): Scroll to the bottom until the page stops growing, for infinite-scroll grids.
+        load_timeout (int): Seconds to wait for a page to load.
+        wait_timeout (int): Seconds to wait for wait_selector, and then for the cards.
+        load_attempts (int): Times a page load is tried before the page counts as failed.
+        rate_limit (dict): Rate limiter settings for the site (see rate_limiter.DEFAULT_RATE_LIMIT),
+            shared by every driver and HTTP fetch talking to it.
+        window_size (str): Browser window size for this retailer's own drivers.
+        block_stylesheets (bool): Block stylesheets in the browser; some grids need them to lay out.
+    """
+
+    def __init__(self, name, source, base_url, url_template, grid_selector, item_selector, image_selector,
+                 name_selectors, price_selectors, page_count, page_size=None, wait_selector=None,
+                 settle_selector=None, require_all_fields=False, scroll=False, load_timeout=30, wait_timeout=30,
+                 load_attempts=1, rate_limit=None, window_size=None, block_stylesheets=True):
+        if "{offset}" in url_template and not page_size:
+            raise ValueError(f"{name}: an offset URL template needs a page_size")
+        self.name = name
+        self.source = source
+        self.base_url = base_url
+        self.url_template = url_template
+        self.grid_selector = grid_selector
+        self.item_selector = item_selector
+        self.image_selector = image_selector
+        self.name_selectors = tuple(name_selectors)
+        self.price_selectors = tuple(price_selectors)
+        self.default_page_count = page_count
+        self.page_size = page_size
+        self.wait_selector = wait_selector or grid_selector
+        self.settle_selector = settle_selector or item_selector
+        self.require_all_fields = require_all_fields
+        self.scroll = scroll
+        self.load_timeout = load_timeout
+        self.wait_timeout = wait_timeout
+        self.load_attempts = load_attempts
+        self.rate_limit = rate_limit
+        self.window_size = window_size
+        self.block_stylesheets = block_stylesheets
+        # (time.monotonic(), page count) from the last crawl that reached the end
+        self._known_page_count = None
+
+    def page_url(self, page_number):
+        """Returns the URL of a listing page."""
+        offset = page_number * self.page_size if self.page_size else None
+        return self.url_template.format(page=page_number, offset=offset, page_size=self.page_size)
+
+    def make_product(self, image_src, product_name, product_price):
+        """Returns a card's product dict, or None (counted as skipped) if it's missing the required details."""
+        found = [image_src, product_name, product_price]
+        if all(found) if self.require_all_fields else any(found):
+            return {
+                "image": image_src,
+                "name": product_name,
+                "price": product_price,
+                "source": self.source
+            }
+        if self.require_all_fields:
+            logging.warning(f"Skipping product due to missing info: name={product_name}, price={product_price}, image={image_src}")
+        increment("products_skipped_total", retailer=self.name)
+        return None
+
+    def parse_product_card(self, card):
+        """Extracts a product from a parsed product card, or returns None if it should be skipped."""
+        image_src = select_attribute(card, self.image_selector, "src", "data-src", base_url=self.base_url)
+        product_name = next(filter(None, (select_text(card, selector) for selector in self.name_selectors)), None)
+        if product_name is None and len(self.name_selectors) > 1:
+            logging.warning("None of the name selectors found the product name")
+        product_price = next(filter(None, (select_text(card, selector) for selector in self.price_selectors)), None)
+        return self.make_product(image_src, product_name, product_price)
+
+    def is_last(self, cards):
+        """Whether a loaded grid with this many cards is the last page: it's empty or short of page_size."""
+        return cards == 0 or bool(self.page_size and cards < self.page_size)
+
+    def parse_product_info(self, html):
+        """
+        Extracts every product from a listing page's HTML in a single parse.
+
+        Returns:
+            ListingPage: The products on the page, or None if the HTML doesn't contain the product grid
+            (for example when it was fetched before the site's scripts rendered it).
+        """
+        document = parse_html(html)
+        if document.select_one(self.grid_selector) is None:
+            return None
+
+        cards = document.select(self.item_selector)
+        products = [product for product in map(self.parse_product_card, cards) if product is not None]
+        return ListingPage(products, len(cards), self.is_last(len(cards)))
+
+    def extract_product_info(self, driver, one_shot=True):
+        """
+        Extracts product information from the page loaded in the driver.
+
+        By default the whole page is read with one driver.page_source call and parsed locally.
+        With one_shot=False every card is read through individual WebDriver calls instead.
+
+        Returns:
+            ListingPage: The products, or None if the grid never appeared: a page that didn't render
+            in time fails like one that didn't load, rather than passing for the end of the catalogue.
+            A grid that rendered and stayed empty for EMPTY_GRID_SECONDS gives an empty last page.
+        """
+        products = None
+
+        try:
+            with timer("stage_seconds", retailer=self.name, stage="grid_wait"):
+                WebDriverWait(driver, self.wait_timeout).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, self.wait_selector))
+                )
+                if self.grid_selector != self.wait_selector:
+                    WebDriverWait(driver, self.wait_timeout).until(
+                        EC.presence_of_element_located((By.CSS_SELECTOR, self.grid_selector))
+                    )
+
+            # Keep scrolling while the page grows, waiting for the new content rather than a fixed time
+            if self.scroll:
+                with timer("stage_seconds", retailer=self.name, stage="scroll"):
+                    scroll_until_stable(driver)
+
+            # Wait until no more cards are being added, allowing for a grid with none, then for the prices
+            with timer("stage_seconds", retailer=self.name, stage="settle_wait"):
+                cards = wait_for_count_to_settle(driver, self.item_selector, timeout=self.wait_timeout,
+                                                 empty_settle_time=EMPTY_GRID_SECONDS)
+                if cards and self.settle_selector != self.item_selector:
+                    wait_for_count_to_settle(driver, self.settle_selector)
+
+            if one_shot:
+                with timer("stage_seconds", retailer=self.name, stage="extract"):
+                    return self.parse_product_info(driver.page_source)
+
+            product_items = driver.find_elements(By.CSS_SELECTOR, self.item_selector)
+            cards = []
+            extract_started = time.perf_counter()
+            for item in product_items:
+                if self.scroll:
+                    driver.execute_script("arguments[0].scrollIntoView();", item)
+                    # Lazy images get their src once in view; wait for that rather than a fixed sleep
+                    try:
+                        WebDriverWait(driver, 2, poll_frequency=0.1).until(
+                            lambda driver: item.find_element(By.CSS_SELECTOR, self.image_selector).get_attribute("src")
+                        )
+                    except Exception as e:
+                        logging.debug(f"Image didn't load after scrolling: {e}")
+
+                image_src = self.find_card_detail(item, [self.image_selector], lambda element: element.get_attribute("src"))
+                product_name = self.find_card_detail(item, self.name_selectors, lambda element: element.text)
+                product_price = self.find_card_detail(item, self.price_selectors, lambda element: element.text)
+                product = self.make_product(image_src, product_name, product_price)
+                if product is not None:
+                    cards.append(product)
+            observe("stage_seconds", time.perf_counter() - extract_started, retailer=self.name, stage="extract")
+            products = ListingPage(cards, len(product_items), self.is_last(len(product_items)))
+
+        except Exception as e:
+            logging.error(f"Error extracting {self.source} product info: {e}")
+            logging.debug(traceback.format_exc())
+
+        return products
+
+    def find_card_detail(self, item, selectors, read):
+        """Reads a detail of a card through WebDriver calls, from the first selector that matches it."""
+        for selector in selectors:
+            try:
+                value = read(item.find_element(By.CSS_SELECTOR, selector))
+            except Exception as e:
+                logging.debug(f"Error finding {selector}: {e}")
+                continue
+            if value:
+                return value
+        return None
+
+    def create_driver(self):
+        """Creates a headless Chrome WebDriver configured for this retailer."""
+        # Images, fonts, media and tracking scripts are blocked; the driver binary is resolved once and cached
+        return driver_factory.create_driver(window_size=self.window_size, block_stylesheets=self.block_stylesheets)
+
+    def shared_driver(self):
+        """Returns the process-wide Chrome instance, set up for this retailer."""
+        return driver_factory.get_shared_driver(block_stylesheets=self.block_stylesheets)
+
+    def scrape_page(self, driver, page_number):
+        """
+        Loads a single listing page and extracts its products.
+
+        Every load is reported to the site's rate limiter, timed from navigation to the end of
+        the load, so the waits for the grid to render don't count as the site being slow.
+
+        Returns None if the page still couldn't be loaded after load_attempts tries.
+        """
+        url = self.page_url(page_number)
+        limiter = get_rate_limiter(url, self.rate_limit)
+
+        for attempt in range(self.load_attempts):
+            started = time.monotonic()
+            try:
+                logging.info(f"Scraping {self.source} page {page_number}...")
+                with timer("stage_seconds", retailer=self.name, stage="navigate"):
+                    driver.get(url)
+                with timer("stage_seconds", retailer=self.name, stage="page_load_wait"):
+                    wait_for_page_load(driver, self.load_timeout)
+                limiter.record(time.monotonic() - started)
+                break
+            except Exception as e:
+                logging.warning(f"Timeout or error on page {page_number}: {e}")
+                # Tell the limiter the site is struggling, so the retry waits for its slower rate
+                limiter.record(time.monotonic() - started, ok=False)
+                if attempt == self.load_attempts - 1:
+                    logging.error(f"Failed to load page {page_number} after {self.load_attempts} attempt(s).")
+                    return None
+                logging.info("Retrying...")
+                increment("page_retries_total", retailer=self.name)
+                with timer("rate_limit_wait_seconds", retailer=self.name):
+                    limiter.acquire()
+
+        products = self.extract_product_info(driver)
+
+        # Keep the page for offline re-parsing; page_source is only read again when archiving is on
+        if get_archive() is not None:
+            with timer("stage_seconds", retailer=self.name, stage="archive"):
+                archive_page(self.name, page_number, driver.current_url, driver.page_source)
+        return products
+
+    def known_page_count(self):
+        """The page count found by the last crawl in this process that reached the end, if it's still fresh."""
+        if self._known_page_count is not None:
+            found_at, count = self._known_page_count
+            if time.monotonic() - found_at < PAGE_COUNT_TTL_SECONDS:
+                return count
+        return None
+
+    def page_count(self):
+        """
+        Returns how many listing pages the catalogue has: as found by the last crawl in this process
+        that reached the end, or otherwise the definition's page_count.
+        """
+        count = self.known_page_count()
+        return count if count is not None else self.default_page_count
+
+    def crawl(self, page_numbers, workers, use_http, http_backend, extending=False, previous=None):
+        """
+        Yields the given pages from the crawl pool or the HTTP fetcher, up to the end of the catalogue.
+
+        Once a page is found to be the last one the pages after it are dropped, and the crawl stops as
+        soon as nothing before it is still outstanding. When extending past the expected end, a page
+        that is empty, failed or the same as the page before it (some sites serve their last page for
+        any page number past it) is taken as the end too, and isn't yielded.
+
+        Args:
+            previous (list): When extending, the products of the page just before these.
+
+        Returns:
+            tuple: (end, tail) where end is the last page's number if it was found, and tail is the
+            products of the highest page asked for (None if it failed or was dropped).
+        """
+        page_numbers = list(page_numbers)
+        if use_http:
+            pages = iter_fetch_pages(page_numbers, self.page_url, self.parse_product_info, self.scrape_page,
+                                     self.create_driver, workers, self.rate_limit, http_backend, self.name)
+        else:
+            # A pool of one driver is the plain serial crawl, which reuses the shared browser
+            driver_source = self.shared_driver if workers <= 1 else self.create_driver
+            pages = iter_crawl_pages(page_numbers, self.scrape_page, driver_source, self.page_url, workers,
+                                     self.rate_limit, self.name)
+
+        highest = max(page_numbers)
+        outstanding = set(page_numbers)
+        # Pages that came back while extending, to spot a site repeating its last page
+        seen = {page_numbers[0] - 1: previous} if extending else {}
+        end, tail = None, None
+        try:
+            for page_number, products in pages:
+                outstanding.discard(page_number)
+                if end is not None and page_number > end:
+                    continue
+                if extending and (not products or products == seen.get(page_number - 1)):
+                    end = page_number - 1
+                else:
+                    if extending:
+                        seen[page_number] = products
+                    # HTTP fallback pages arrive after the rest, so the highest page isn't always the last to come
+                    if page_number == highest:
+                        tail = products
+                    yield page_number, products
+                    if not is_last_page(products):
+                        continue
+                    end = page_number if products else page_number - 1
+
+                logging.info(f"{self.source}: reached the end of the catalogue at page {end}.")
+                self._known_page_count = (time.monotonic(), end + 1)
+                if all(page > end for page in outstanding):
+                    break
+        finally:
+            pages.close()
+        return end, tail
+
+    def iter_pages(self, page_numbers=None, workers=1, use_http=False, http_backend=None, follow_to_end=None):
+        """
+        Scrapes the listing pages one at a time, yielding (page_number, products) as soon as each page is done.
+
+        Only the current page's products are held in memory, so callers can store them straight away.
+        page_numbers defaults to the whole catalogue, sized by page_count(). A page that fails is
+        yielded with products set to None and the crawl carries on with the next page.
+
+        The crawl stops at the end of the catalogue: once a page's grid loads empty or short of a
+        full page (see is_last_page()), the pages after it are skipped. With follow_to_end,
+        the default for a whole-catalogue crawl, it also carries on past the last page asked for while
+        pages keep coming back full and the catalogue size is only the definition's estimate, so
+        products added since it was counted aren't missed.
+
+        With workers > 1 the pages are shared out between that many headless drivers. Requests
+        always go through the site's adaptive rate limiter, configured by rate_limit.
+
+        With use_http=True listing pages are downloaded over a pooled HTTP session (or the given
+        http_backend) and parsed directly; only pages without a product grid are loaded in Chrome.
+        """
+        if follow_to_end is None:
+            follow_to_end = page_numbers is None
+        if page_numbers is None:
+            page_numbers = range(0, self.page_count())
+        page_numbers = list(page_numbers)
+        if not page_numbers:
+            return
+
+        estimated = self.known_page_count() is None
+        end, tail = yield from self.crawl(page_numbers, workers, use_http, http_backend)
+        if end is not None or not follow_to_end or not estimated:
+            return
+
+        next_page = max(page_numbers) + 1
+        if next_page < self.default_page_count:
+            return  # Stopped short of the expected end anyway
+        while tail and next_page < self.default_page_count + MAX_EXTRA_PAGES:
+            logging.info(f"{self.source}: page {next_page - 1} still has products, crawling past the expected end.")
+            chunk = range(next_page, next_page + EXTEND_PAGES)
+            end, tail = yield from self.crawl(chunk, workers, use_http, http_backend, extending=True, previous=tail)
+            if end is not None:
+                return
+            next_page += EXTEND_PAGES
+
+    def main(self, workers=1, use_http=False, http_backend=None):
+        """
+        Scrapes the whole catalogue and collects every page from iter_pages into one list; see
+        iter_pages for the options.
+        """
+        all_products = []
+        for page_number, products in self.iter_pages(workers=workers, use_http=use_http, http_backend=http_backend):
+            if products is not None:
+                all_products.extend(products)
+
+        return all_products if all_products else []
@@ -0,0 +1,62 @@
+import logging
+import time
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+def wait_for_page_load(driver, timeout):
+    """Waits until the browser reports the document has finished loading, and logs how long the load took."""
+    WebDriverWait(driver, timeout).until(
+        lambda driver: driver.execute_script("return document.readyState") == "complete"
+    )
+    duration = driver.execute_script(
+        "const entry = performance.getEntriesByType('navigation')[0]; return entry ? entry.duration : null;"
+    )
+    if duration is not None:
+        logging.info(f"Page loaded in {duration / 1000:.2f}s")
+
+def wait_for_count_to_settle(driver, selector, timeout=10, settle_time=0.5, poll_frequency=0.2, empty_settle_time=None):
+    """
+    Waits until the number of elements matching selector stops changing.
+
+    Lazy-loaded grids add cards (or fill in prices) in bursts; the count has to stay the same,
+    and above zero, for settle_time seconds. With empty_settle_time, no elements at all also
+    counts as settled once it has lasted that long. Returns the final count, or the count at
+    the timeout if the page never settled.
+    """
+    state = {"count": -1, "since": time.monotonic()}
+
+    def settled(driver):
+        count = len(driver.find_elements(By.CSS_SELECTOR, selector))
+        now = time.monotonic()
+        if count != state["count"]:
+            state["count"] = count
+            state["since"] = now
+            return False
+        if count == 0:
+            return empty_settle_time is not None and now - state["since"] >= empty_settle_time
+        return now - state["since"] >= settle_time
+
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=poll_frequency).until(settled)
+    except TimeoutException:
+        pass
+    return max(state["count"], 0)
+
+def scroll_until_stable(driver, timeout_per_step=5):
+    """
+    Scrolls to the bottom of an infinite-scroll page until it stops growing.
+
+    After each scroll it waits only as long as it takes the page height to change,
+    up to timeout_per_step seconds, instead of sleeping a fixed time.
+    """
+    last_height = driver.execute_script("return document.body.scrollHeight")
+    while True:
+        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+        try:
+            WebDriverWait(driver, timeout_per_step, poll_frequency=0.2).until(
+                lambda driver: driver.execute_script("return document.body.scrollHeight") != last_height
+            )
+        except TimeoutException:
+            return
+        last_height = driver.execute_script("return document.body.scrollHeight")